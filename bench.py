@@ -0,0 +1,269 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+from os.path import abspath, dirname, join
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CBOB_DIR = dirname(abspath(__file__))
+CBOB_PATH = join(CBOB_DIR, "cbob.py")
+
+# A regression is reported if a scenario's median got slower by more than this (relative) amount.
+DEFAULT_THRESHOLD = 0.1
+
+HEADER_TEMPLATE = """#ifndef {guard}
+#define {guard}
+{includes}
+struct {name}_s {{ int a; long b; double c[4]; }};
+static inline int {name}_value(int x) {{ return x * {number} + {number}; }}
+int {name}_f(struct {name}_s *s);
+#endif
+"""
+
+SOURCE_TEMPLATE = """{includes}
+int {name}(int x) {{
+    int y = x;
+    for (int i = 0; i < {number}; ++i) {{
+        y = (y * 31 + i) % 1000003;
+    }}
+    return y;
+}}
+"""
+
+MAIN_TEMPLATE = """{declarations}
+int main(void) {{
+    int sum = 0;
+{calls}
+    return sum == 42 ? 1 : 0;
+}}
+"""
+
+class SyntheticProject(object):
+    def __init__(self, path, sources, headers, depth, fanout, targets, subprojects, language, seed=0):
+        self.path = path
+        self.sources = sources
+        self.headers = headers
+        self.depth = max(1, depth)
+        self.fanout = fanout
+        self.targets = targets
+        self.subprojects = subprojects
+        self.ext = ".c" if language == "c" else ".cpp"
+        self.random = random.Random(seed)
+        self.target_names = []
+        self.source_paths = []
+        self.common_header_path = None
+
+    def generate(self):
+        os.makedirs(join(self.path, "include"), exist_ok=True)
+        os.makedirs(join(self.path, "src"), exist_ok=True)
+        self._cbob("init")
+
+        # The headers are organized in `depth` levels; each header includes `fanout` headers of the
+        # next level, and every source includes `fanout` headers of the first level. On top of that,
+        # there's one header every source includes (to measure the edit of a widely-included header).
+        levels = [[] for _ in range(self.depth)]
+        for number in range(self.headers):
+            levels[number * self.depth // max(1, self.headers)].append("h{}.h".format(number))
+        for level, header_names in reversed(list(enumerate(levels))):
+            next_level = levels[level + 1] if level + 1 < self.depth else []
+            for header_name in header_names:
+                self._write_header(join(self.path, "include", header_name), header_name, self._pick(next_level))
+        self.common_header_path = join(self.path, "include", "common.h")
+        self._write_header(self.common_header_path, "common.h", [])
+
+        for target_number in range(self.targets):
+            target_name = "t{}".format(target_number)
+            function_names = []
+            target_sources = []
+            for source_number in range(self.sources):
+                name = "{}_s{}".format(target_name, source_number)
+                includes = ["common.h"] + self._pick(levels[0])
+                source_path = join(self.path, "src", name + self.ext)
+                self._write(source_path, SOURCE_TEMPLATE.format(
+                    includes=self._includes(includes, "../include/"),
+                    name=name,
+                    number=source_number + 1))
+                function_names.append(name)
+                target_sources.append(source_path)
+            main_path = join(self.path, "src", target_name + "_main" + self.ext)
+            self._write(main_path, MAIN_TEMPLATE.format(
+                declarations="\n".join("int {}(int x);".format(name) for name in function_names),
+                calls="\n".join("    sum += {}(sum);".format(name) for name in function_names)))
+            target_sources.append(main_path)
+
+            self._cbob("new", target_name)
+            self._cbob("add", "--target", target_name, *target_sources)
+            self._cbob("configure", "--target", target_name, "--compiler", "gcc" if self.ext == ".c" else "g++", "--bindir", self.path)
+            self.target_names.append(target_name)
+            self.source_paths += target_sources
+
+        # A virtual target that depends on everything, so that one `cbob build` builds it all
+        self._cbob("new", "all")
+        self._cbob("dependencies", "add", "--target", "all", *self.target_names)
+
+        for sub_number in range(self.subprojects):
+            sub_name = "sub{}".format(sub_number)
+            subproject = SyntheticProject(join(self.path, sub_name), self.sources, self.headers, self.depth, self.fanout, 1, 0, "c" if self.ext == ".c" else "cpp", seed=sub_number + 1)
+            subproject.generate()
+            self._cbob("subprojects", "add", sub_name)
+            self._cbob("dependencies", "add", "--target", "all", "{}.t0".format(sub_name))
+            self.target_names.append("{}.t0".format(sub_name))
+            self.source_paths += subproject.source_paths
+        # `cbob new` made the first target the default one, but we want to build everything
+        os.remove(join(self.path, ".cbob", "targets", "_default"))
+        os.symlink("all", join(self.path, ".cbob", "targets", "_default"))
+
+    def _pick(self, header_names):
+        return self.random.sample(header_names, min(self.fanout, len(header_names)))
+
+    def _includes(self, header_names, prefix):
+        return "\n".join("#include \"{}{}\"".format(prefix, header_name) for header_name in header_names)
+
+    def _write_header(self, path, header_name, included_names):
+        name = header_name[:-2].replace(".", "_")
+        self._write(path, HEADER_TEMPLATE.format(
+            guard=name.upper() + "_H",
+            includes=self._includes(included_names, ""),
+            name=name,
+            number=len(name)))
+
+    def _write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _cbob(self, *args):
+        with open(os.devnull, "w") as null:
+            subprocess.check_call((sys.executable, CBOB_PATH) + args, stdout=null, cwd=self.path)
+
+def _time_cmd(cmd, repeat, cwd=None, prepare=None, env=None):
+    timings = []
+    with open(os.devnull, "w") as null:
+        for _ in range(repeat):
+            if prepare is not None:
+                prepare()
+            start = time.perf_counter()
+            return_code = subprocess.call(cmd, stdout=null, stderr=null, cwd=cwd, env=env)
+            timings.append(time.perf_counter() - start)
+            if return_code != 0:
+                raise RuntimeError("'{}' failed".format(" ".join(cmd)))
+    return timings
+
+def _touch(path):
+    # Make sure the new mtime is really newer, even on file systems with a coarse resolution
+    new_time = max(time.time(), os.path.getmtime(path) + 1)
+    os.utime(path, (new_time, new_time))
+
+def bench_startup(repeat):
+    results = {}
+    results["python"] = _time_cmd((sys.executable, "-c", "pass"), repeat)
+    results["import cbob.main"] = _time_cmd((sys.executable, "-c", "import cbob.main"), repeat, cwd=CBOB_DIR)
+    results["cbob --help"] = _time_cmd((sys.executable, CBOB_PATH, "--help"), repeat)
+    results["cbob build --help"] = _time_cmd((sys.executable, CBOB_PATH, "build", "--help"), repeat)
+    return results
+
+def bench_project(project, repeat, jobs):
+    cbob = (sys.executable, CBOB_PATH)
+    build = cbob + ("build",) + (("--jobs", str(jobs)) if jobs else ())
+
+    def clean():
+        for target_name in project.target_names:
+            _time_cmd(cbob + ("clean", "--all", "--target", target_name), 1, cwd=project.path)
+
+    env = dict(os.environ, PYTHONPATH=CBOB_DIR)
+    scan = (sys.executable, "-c", "import cbob.target; cbob.target.get_target('t0').dep_graph")
+
+    results = {}
+    results["startup (cbob list)"] = _time_cmd(cbob + ("list", "--target", "t0"), repeat, cwd=project.path)
+    results["full build"] = _time_cmd(build, repeat, cwd=project.path, prepare=clean)
+    results["no-op build"] = _time_cmd(build, repeat, cwd=project.path)
+    results["one source edited"] = _time_cmd(build, repeat, cwd=project.path, prepare=lambda: _touch(project.source_paths[0]))
+    results["common header edited"] = _time_cmd(build, repeat, cwd=project.path, prepare=lambda: _touch(project.common_header_path))
+    results["dependency scan only"] = _time_cmd(scan, repeat, cwd=project.path, env=env)
+    return results
+
+def summarize(results):
+    return {name: {
+        "median": statistics.median(timings),
+        "min": min(timings),
+        "runs": timings} for name, timings in results.items()}
+
+def compare(summary, baseline, threshold):
+    regressions = []
+    print("{:<28} {:>10} {:>10} {:>8}".format("scenario", "baseline", "now", "change"))
+    for name, result in summary.items():
+        if name not in baseline:
+            print("{:<28} {:>10} {:9.2f}ms {:>8}".format(name, "-", result["median"] * 1000, "new"))
+            continue
+        old = baseline[name]["median"]
+        change = (result["median"] - old) / old if old else 0
+        mark = ""
+        if change > threshold:
+            regressions.append(name)
+            mark = "  REGRESSION"
+        print("{:<28} {:9.2f}ms {:9.2f}ms {:+7.1%}{}".format(name, old * 1000, result["median"] * 1000, change, mark))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cbob.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="How often each measurement is repeated (default: 5).")
+    parser.add_argument("-b", "--budget", type=float, help="Fail if the median startup time of a cbob command exceeds this many milliseconds.")
+    parser.add_argument("--startup-only", action="store_true", help="Only measure startup times (no synthetic project is generated).")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    parser.add_argument("-c", "--compare", metavar="baseline", help="Compare with the results stored in this JSON file (and fail on regressions).")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative slowdown that counts as regression (default: {}).".format(DEFAULT_THRESHOLD))
+    parser.add_argument("-j", "--jobs", type=int, help="Passed on to 'cbob build'.")
+    project_args = parser.add_argument_group("synthetic project")
+    project_args.add_argument("--sources", type=int, default=50, help="Sources per target (default: 50).")
+    project_args.add_argument("--headers", type=int, default=100, help="Headers per project (default: 100).")
+    project_args.add_argument("--depth", type=int, default=4, help="Levels of nested includes (default: 4).")
+    project_args.add_argument("--fanout", type=int, default=4, help="Headers included by every source and header (default: 4).")
+    project_args.add_argument("--targets", type=int, default=2, help="Number of targets (default: 2).")
+    project_args.add_argument("--subprojects", type=int, default=1, help="Number of subprojects with one target each (default: 1).")
+    project_args.add_argument("--language", choices=("c", "cpp"), default="c", help="Language of the sources (default: 'c').")
+    parser.add_argument("--keep", metavar="dir", help="Generate the project in this directory and keep it.")
+    args = parser.parse_args()
+
+    results = bench_startup(args.repeat)
+    parameters = {"repeat": args.repeat}
+    if not args.startup_only:
+        parameters.update({name: getattr(args, name) for name in ("sources", "headers", "depth", "fanout", "targets", "subprojects", "language", "jobs")})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            project_dir = abspath(args.keep) if args.keep else tmp_dir
+            project = SyntheticProject(project_dir, args.sources, args.headers, args.depth, args.fanout, args.targets, args.subprojects, args.language)
+            project.generate()
+            results.update(bench_project(project, args.repeat, args.jobs))
+
+    summary = summarize(results)
+    for name, result in summary.items():
+        print("{:<28} median {:9.2f} ms   min {:9.2f} ms".format(name, result["median"] * 1000, result["min"] * 1000))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"parameters": parameters, "python": sys.version, "results": summary}, output_file, indent=2)
+
+    failed = False
+    if args.budget is not None:
+        for name, result in summary.items():
+            if name.startswith("cbob") and result["median"] * 1000 > args.budget:
+                print("startup budget of {} ms exceeded by '{}'".format(args.budget, name))
+                failed = True
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("parameters") != parameters:
+            print("warning: the baseline was measured with different parameters")
+        regressions = compare(summary, baseline["results"], args.threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            failed = True
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
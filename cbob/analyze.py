@@ -0,0 +1,112 @@
+from collections import namedtuple
+from functools import partial
+import logging
+
+HeaderCost = namedtuple("HeaderCost", ("path", "dependents", "rebuild_time", "unknown_times", "direct_includes", "all_includes"))
+
+SORT_KEYS = {
+    "rebuild": lambda cost: (cost.rebuild_time, cost.dependents),
+    "dependents": lambda cost: (cost.dependents, cost.rebuild_time),
+    "fanout": lambda cost: (cost.all_includes, cost.direct_includes),
+}
+
+def latest_compile_times(build_log_entries):
+    compile_times = {}
+    for entry in build_log_entries:
+        if entry.kind == "compile" and entry.status == 0:
+            compile_times[entry.output] = (entry.end - entry.start) / 1000
+    return compile_times
+
+def header_costs(dep_graph, compile_times):
+    dependents = {}
+    for source_node in dep_graph.roots:
+        for include_path in set(source_node.include_paths):
+            dependents.setdefault(include_path, []).append(source_node)
+
+    costs = []
+    for path, header_id in dep_graph.headers.items():
+        source_nodes = dependents.get(path, ())
+        rebuild_time = sum(compile_times.get(node.object_path, 0) for node in source_nodes)
+        unknown_times = sum(1 for node in source_nodes if node.object_path not in compile_times)
+        costs.append(HeaderCost(
+            path,
+            len(source_nodes),
+            rebuild_time,
+            unknown_times,
+            len(dep_graph.includes(header_id)),
+            len(_all_includes(dep_graph, header_id))))
+    return costs
+
+def _all_includes(dep_graph, header_id):
+    seen = set()
+    stack = list(dep_graph.includes(header_id))
+    while stack:
+        node_id = stack.pop()
+        if node_id not in seen:
+            seen.add(node_id)
+            stack.extend(dep_graph.includes(node_id))
+    return seen
+
+def parse_time(header_path, compiler_path, language):
+    import subprocess
+    import time
+    from cbob.counters import popen
+    # `-ftime-report` makes GCC report how long it took to parse the header. For compilers that
+    # don't understand it (or don't report a parsing phase), the wall clock time has to do.
+    header_type = "c-header" if language == "C" else "c++-header"
+    cmd = (compiler_path, "-fsyntax-only", "-ftime-report", "-x", header_type, header_path)
+    start = time.perf_counter()
+    with popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True) as process:
+        err = process.communicate()[1]
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        # Most likely the header can't be parsed on its own
+        return header_path, None
+    reported_time = parse_time_report(err)
+    return header_path, wall_time if reported_time is None else reported_time
+
+def parse_time_report(err):
+    # The parsing time in the output of `-ftime-report`, if there is one
+    import re
+    for line in err.split("\n"):
+        name, sep, times = line.partition(":")
+        if sep and name.strip() == "phase parsing":
+            # The columns are usr, sys and wall time, each followed by a (padded) percentage
+            columns = re.findall(r"([\d.]+) \(\s*\d+%\)", times)
+            if len(columns) >= 3:
+                return float(columns[2])
+            break
+    return None
+
+def print_header_costs(target, count, sort, parse_times):
+    from cbob.build_log import read
+    compile_times = latest_compile_times(read(target.build_log_path))
+    costs = header_costs(target.dep_graph, compile_times)
+    costs.sort(key=SORT_KEYS[sort], reverse=True)
+    costs = costs[:count]
+
+    parse_time_by_header = {}
+    if parse_times and costs:
+        logging.info("measuring parse times ...")
+        get_parse_time = partial(parse_time, compiler_path=target.compiler, language=target.language)
+        parse_time_by_header = dict(target.local_pool.imap_unordered(get_parse_time, [cost.path for cost in costs]))
+        logging.info("done.")
+
+    print("Headers of target '{}' (by {}):".format(target.name, sort))
+    if not costs:
+        print("  (none)")
+        return
+    if not compile_times:
+        print("  (no compile times recorded yet - build the target to get rebuild time estimates)")
+    print("  {:>10}  {:>7}  {:>15}{}  {}".format("rebuild", "sources", "includes (all)", "      parse" if parse_times else "", "header"))
+    for cost in costs:
+        rebuild = "{:9.3f}s".format(cost.rebuild_time)
+        if cost.unknown_times:
+            # Some dependent sources were never compiled (successfully), so this is a lower bound
+            rebuild = ">" + rebuild.lstrip()
+        includes = "{} ({})".format(cost.direct_includes, cost.all_includes)
+        parse_column = ""
+        if parse_times:
+            measured = parse_time_by_header.get(cost.path)
+            parse_column = "  {:9.3f}s".format(measured) if measured is not None else "  {:>10}".format("n/a")
+        print("  {:>10}  {:7}  {:>15}{}  {}".format(rebuild, cost.dependents, includes, parse_column, cost.path))
@@ -0,0 +1,68 @@
+from collections import namedtuple
+import os
+import threading
+import time
+
+# The build log is an append-only text file (much like ninja's `.ninja_log`) with one line per job,
+# its tab-separated fields being those of `LogEntry`. Times are milliseconds since the start of the
+# build the job belonged to, and builds are identified by the (unix) time in milliseconds they
+# were started at.
+LOG_VERSION_LINE = "# cbob log v1\n"
+
+LogEntry = namedtuple("LogEntry", ("build_id", "start", "end", "kind", "status", "max_rss", "cmd_hash", "output"))
+
+class BuildLog(object):
+    def __init__(self, path):
+        self.path = path
+        self.build_id = int(time.time() * 1000)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def now(self):
+        return int((time.perf_counter() - self._start) * 1000)
+
+    def record(self, kind, start, status, max_rss, cmd, output):
+        entry = LogEntry(self.build_id, start, self.now(), kind, status, max_rss, command_hash(cmd), output)
+        line = "\t".join(str(field) for field in entry) + "\n"
+        with self._lock:
+            if self._file is None:
+                is_new = not os.path.isfile(self.path)
+                self._file = open(self.path, "a")
+                if is_new:
+                    self._file.write(LOG_VERSION_LINE)
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def command_hash(cmd):
+    from hashlib import sha1
+    return sha1("\0".join(cmd).encode("utf-8")).hexdigest()[:16]
+
+def read(path):
+    entries = []
+    try:
+        with open(path, "r") as log_file:
+            for line in log_file:
+                if line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != len(LogEntry._fields):
+                    # Most likely a line that was cut off by a crashing or killed build.
+                    continue
+                build_id, start, end, kind, status, max_rss, cmd_hash, output = fields
+                entries.append(LogEntry(int(build_id), int(start), int(end), kind, int(status), int(max_rss), cmd_hash, output))
+    except IOError:
+        pass
+    return entries
+
+def wait(process):
+    # We reap the child ourselves instead of using `process.wait()`, because that's the only way to
+    # get at its resource usage. On Linux, `ru_maxrss` is in kilobytes.
+    pid, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage.ru_maxrss
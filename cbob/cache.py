@@ -0,0 +1,103 @@
+from hashlib import sha256 as hashfn
+import logging
+import os
+from os.path import relpath
+import threading
+
+# A shared cache for object files, spoken to over plain HTTP: `GET <url>/<key>` fetches an object
+# (404 if it isn't cached), `PUT <url>/<key>` stores one. `python -m cbob.cache_server` serves such a
+# cache from a local directory.
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_REQUESTS = 8
+
+def object_key(compiler_id, flags, source_node, content_hash, root_path, system_headers=()):
+    # Paths inside the project are taken relative to its root, so that different checkouts (on
+    # different machines) share their objects.
+    def rel(path):
+        rel_path = relpath(path, root_path)
+        return path if rel_path.startswith(os.pardir) else rel_path
+    key = hashfn()
+    key.update(compiler_id.encode())
+    key.update("\0".join(flags).encode())
+    key.update("\0{}\0{}".format(rel(source_node.path), content_hash(source_node.path)).encode())
+    for include_path in source_node.include_paths:
+        key.update("\0{}\0{}".format(rel(include_path), content_hash(include_path)).encode())
+    # Machines with the same compiler may still have different headers (of libraries, say)
+    for header_path in system_headers:
+        key.update("\0{}\0{}".format(header_path, content_hash(header_path)).encode())
+    return key.hexdigest()
+
+class RemoteCache(object):
+    def __init__(self, url, mode="read-write", timeout=DEFAULT_TIMEOUT, max_requests=DEFAULT_MAX_REQUESTS):
+        self.url = url.rstrip("/")
+        self.writable = mode == "read-write"
+        self.timeout = timeout
+        self._broken = False
+        self._requests = threading.BoundedSemaphore(max_requests)
+        self._compiler_ids = {}
+        self._lock = threading.Lock()
+
+    def compiler_id(self, compiler_path):
+        # The version output identifies the compiler across machines (unlike its path or mtime)
+        with self._lock:
+            if compiler_path not in self._compiler_ids:
+                import subprocess
+                from cbob.counters import popen
+                with popen((compiler_path, "--version"), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+                    self._compiler_ids[compiler_path] = process.communicate()[0].decode(errors="replace")
+            return self._compiler_ids[compiler_path]
+
+    def _request(self, method, key, data=None):
+        import urllib.request
+        request = urllib.request.Request("{}/{}".format(self.url, key), data=data, method=method)
+        with self._requests:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+
+    def _failed(self, e):
+        # If the cache isn't reachable, every further request would just wait for the timeout
+        with self._lock:
+            if not self._broken:
+                logging.warning("object cache at '{}' failed ({}) - not using it for the rest of this build".format(self.url, e))
+            self._broken = True
+
+    def get(self, key):
+        import urllib.error
+        if self._broken:
+            return None
+        try:
+            data = self._request("GET", key)
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                self._failed(e)
+            data = None
+        except OSError as e:
+            self._failed(e)
+            data = None
+        return data
+
+    def put(self, key, data):
+        if self._broken or not self.writable:
+            return
+        try:
+            self._request("PUT", key, data)
+        except OSError as e:
+            self._failed(e)
+
+current = None
+
+def connect(url, mode):
+    global current
+    from cbob.definitions import CACHE_MODES
+    from cbob.error import CbobError
+    if not url.startswith(("http://", "https://")):
+        raise CbobError("'{}' is not an HTTP URL.".format(url))
+    if mode not in CACHE_MODES:
+        raise CbobError("'{}' is not a cache mode (one of {}).".format(mode, ", ".join(CACHE_MODES)))
+    current = RemoteCache(url, mode)
+    return current
+
+def disconnect():
+    global current
+    current = None
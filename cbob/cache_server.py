@@ -0,0 +1,92 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+from os.path import join, isfile
+import re
+
+# A minimal server for cbob's object cache (see cbob/cache.py), storing the objects in a directory:
+#     python -m cbob.cache_server --dir /var/cache/cbob --port 8377
+
+DEFAULT_PORT = 8377
+MAX_OBJECT_SIZE = 1 << 30
+
+_KEY = re.compile(r"^/([0-9a-f]{64})$")
+
+class CacheHandler(BaseHTTPRequestHandler):
+    def _object_path(self):
+        match = _KEY.match(self.path)
+        if match is None:
+            self.send_error(400, "not a cache key")
+            return None
+        key = match.group(1)
+        return join(self.server.cache_dir, key[:2], key)
+
+    def do_GET(self):
+        path = self._object_path()
+        if path is None:
+            return
+        if not isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as object_file:
+            data = object_file.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        path = self._object_path()
+        if path is None:
+            return
+        if self.server.read_only:
+            self.send_error(403, "read-only cache")
+            return
+        size = int(self.headers.get("Content-Length", 0))
+        if size > MAX_OBJECT_SIZE:
+            self.send_error(413)
+            return
+        data = self.rfile.read(size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent PUTs of the same key write the same object, so the last one may just win
+        tmp_path = "{}.{}.tmp".format(path, id(self))
+        with open(tmp_path, "wb") as object_file:
+            object_file.write(data)
+        os.replace(tmp_path, path)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache_dir, read_only=False, verbose=False):
+        super().__init__(address, CacheHandler)
+        self.cache_dir = cache_dir
+        self.read_only = read_only
+        self.verbose = verbose
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a cbob object cache.", prog="python -m cbob.cache_server")
+    parser.add_argument("--host", default="localhost", help="The address to listen on (default: 'localhost').")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="The port to listen on (default: {}; 0 picks a free one).".format(DEFAULT_PORT))
+    parser.add_argument("-d", "--dir", default="cbob-cache", help="Where to store the objects (default: 'cbob-cache').")
+    parser.add_argument("--read-only", action="store_true", help="Refuse to store objects.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    with CacheServer((args.host, args.port), os.path.abspath(args.dir), args.read_only, args.verbose) as server:
+        print("cbob cache server listening on http://{}:{}/ (storing objects in '{}')".format(args.host, server.server_address[1], args.dir), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
@@ -33,10 +33,56 @@ def list_(target=None):
     current_target = cbob.target.get_target(target)
     current_target.list_()
 
-def build(target=None, jobs=None, oneshot=None, keep_going=None):
-    import cbob.target
-    current_target = cbob.target.get_target(target)
-    current_target.build(jobs, oneshot, keep_going)
+def build(target=None, jobs=None, link_jobs=None, variants=None, oneshot=None, keep_going=None, trace=None, stats=False, metrics_file=None, workers=None, cache=None, cache_mode="read-write", shard=None, merge=None):
+    import cbob.target
+    import cbob.counters
+    import cbob.headers
+    import cbob.stat_cache
+    build_counters = cbob.counters.reset()
+    cbob.headers.reset()
+    cbob.stat_cache.reset()
+    if trace is not None:
+        import cbob.trace
+        cbob.trace.start()
+    if workers is not None:
+        import os
+        import cbob.remote
+        cbob.remote.connect(workers.split(","), jobs or os.cpu_count())
+    if cache is not None:
+        import cbob.cache
+        cbob.cache.connect(cache, cache_mode)
+    try:
+        shard_index = bundles = None
+        if shard is not None or merge:
+            # (Tar files and JSON are of no interest to other builds)
+            import cbob.shards
+            shard_index = cbob.shards.parse_shard(shard) if shard is not None else None
+            bundles = cbob.shards.read_manifests(merge) if merge else None
+        current_target = cbob.target.get_target(target)
+        current_target.build(jobs, oneshot, keep_going, link_jobs, variants.split(",") if variants else None, shard_index, bundles)
+    finally:
+        if trace is not None:
+            cbob.trace.stop(trace)
+        if stats:
+            print(build_counters.report())
+        if metrics_file is not None:
+            import cbob.metrics
+            cbob.metrics.write(build_counters, metrics_file)
+        if workers is not None:
+            cbob.remote.disconnect()
+        if cache is not None:
+            cbob.cache.disconnect()
+    return build_counters
+
+def stats(target=None, count=10):
+    import cbob.target
+    current_target = cbob.target.get_target(target)
+    current_target.stats(count)
+
+def analyze(target=None, count=20, sort="rebuild", parse_times=False):
+    import cbob.target
+    current_target = cbob.target.get_target(target)
+    current_target.analyze(count, sort, parse_times)
 
 def dependencies_add(target=None, dependencies=None):
     import cbob.target
@@ -53,10 +99,10 @@ def dependencies_list(target=None):
     current_target = cbob.target.get_target(target)
     current_target.dependencies_list()
 
-def configure(target=None, auto=None, force=None, compiler=None, bindir=None):
+def configure(target=None, auto=None, force=None, compiler=None, bindir=None, kind=None, linker=None, rebuild_check=None, content_hashes=None):
     import cbob.target
     current_target = cbob.target.get_target(target)
-    current_target.configure(auto, force, compiler, bindir)
+    current_target.configure(auto, force, compiler, bindir, kind, linker, rebuild_check, content_hashes)
 
 def subprojects_add(projects):
     import cbob.project
@@ -105,3 +151,8 @@ def options_list(option, target=None):
     import cbob.target
     current_target = cbob.target.get_target(target)
     current_target.options_list(option)
+
+def worker(host="localhost", port=None, jobs=None):
+    import os
+    import cbob.remote
+    cbob.remote.serve(host, cbob.remote.DEFAULT_PORT if port is None else port, jobs or os.cpu_count())
@@ -0,0 +1,101 @@
+from contextlib import contextmanager
+import threading
+import time
+
+from cbob.trace import span
+
+# Counts what a build costs in terms of the operating system: processes spawned, files stat'ed and
+# bytes read, plus the time spent in each phase of building a target. Everything cbob does to the
+# file system on the hot path of a build goes through the functions below.
+# Per-target numbers are keyed by `(project name, target name)`, so that targets of different
+# (sub)projects with the same name don't get mixed up.
+
+def target_key(target):
+    return (target.project.name, target.display_name)
+
+class BuildCounters(object):
+    def __init__(self):
+        self.spawns = 0
+        self.stat_calls = 0
+        self.bytes_read = 0
+        self.phases = {}
+        self.counts = {}
+        self.running_jobs = {}
+        self.peak_jobs = {}
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def add(self, spawns=0, stat_calls=0, bytes_read=0):
+        with self._lock:
+            self.spawns += spawns
+            self.stat_calls += stat_calls
+            self.bytes_read += bytes_read
+
+    def add_phase_time(self, key, phase_name, seconds):
+        with self._lock:
+            self.phases[key, phase_name] = self.phases.get((key, phase_name), 0) + seconds
+
+    def count(self, key, name, number=1):
+        with self._lock:
+            self.counts[key, name] = self.counts.get((key, name), 0) + number
+
+    def job_started(self, key):
+        with self._lock:
+            running = self.running_jobs.get(key, 0) + 1
+            self.running_jobs[key] = running
+            self.peak_jobs[key] = max(self.peak_jobs.get(key, 0), running)
+
+    def job_finished(self, key):
+        with self._lock:
+            self.running_jobs[key] -= 1
+
+    def set_result(self, key, succeeded):
+        with self._lock:
+            self.results[key] = (succeeded, time.time())
+
+    @property
+    def targets(self):
+        keys = set(self.results)
+        keys.update(key for key, name in self.phases)
+        keys.update(key for key, name in self.counts)
+        return sorted(keys)
+
+    def report(self):
+        lines = ["cbob build statistics:"]
+        lines.append("  spawns {}".format(self.spawns))
+        lines.append("  stat_calls {}".format(self.stat_calls))
+        lines.append("  bytes_read {}".format(self.bytes_read))
+        for ((project_name, target_name), phase_name), seconds in self.phases.items():
+            lines.append("  phase {}:{} {:.3f}".format(target_name, phase_name, seconds))
+        return "\n".join(lines)
+
+current = BuildCounters()
+
+def reset():
+    global current
+    current = BuildCounters()
+    return current
+
+@contextmanager
+def phase(target, phase_name):
+    start = time.perf_counter()
+    try:
+        with span(phase_name, "phase", target=target.display_name):
+            yield
+    finally:
+        current.add_phase_time(target_key(target), phase_name, time.perf_counter() - start)
+
+@contextmanager
+def job(target):
+    # Wraps every compiler invocation (and the like), to find out how many of them ran in parallel
+    key = target_key(target)
+    current.job_started(key)
+    try:
+        yield
+    finally:
+        current.job_finished(key)
+
+def popen(cmd, **kwargs):
+    import subprocess
+    current.add(spawns=1)
+    return subprocess.Popen(cmd, **kwargs)
@@ -1,4 +1,22 @@
 SOURCE_FILE_EXTENSIONS = frozenset((".c", ".cpp", ".cxx", ".c++", ".cc"))
+TARGET_KINDS = ("executable", "static", "shared")
+# How a source whose (or whose headers') mtime changed is found to need recompiling: always, or only
+# if its preprocessed text (without comments and blank lines) changed as well.
+REBUILD_CHECKS = ("mtime", "preprocessed")
+# Where the content hashes of sources and headers (for the object cache) come from: the files
+# themselves, or the git index for tracked files that weren't modified (see `cbob.hashing`).
+CONTENT_HASHES = ("files", "git")
+# Whether a build stores the objects it compiled in the object cache, or only fetches them
+CACHE_MODES = ("read-write", "read-only")
+# The flags for each linker that `-fuse-ld` knows, with their multi-threading enabled where it's
+# not the default.
+LINKERS = {
+    "default": (),
+    "bfd": ("-fuse-ld=bfd",),
+    "gold": ("-fuse-ld=gold", "-Wl,--threads"),
+    "lld": ("-fuse-ld=lld",),
+    "mold": ("-fuse-ld=mold",),
+}
 HOOKS = frozenset(("pre_build", "post_build", "pre_add", "post_add"))
 SYNONYMS = {
     "on": frozenset(("on", "true", "1", 1, "enabled", "yes")),
@@ -1,69 +1,283 @@
+from array import array
 from functools import partial
+from itertools import chain
+import logging
 import os
 
-from cbob.node import SourceNode, HeaderNode
+import cbob.counters as counters
+import cbob.headers
+import cbob.stat_cache
+from cbob.node import SourceNode
+from cbob.toolchain import system_include_dirs as system_include_dirs_of
+from cbob.trace import span
+
+# Scanning many small sources is mostly spent starting processes, so one GCC scans several of them
+MAX_SCAN_BATCH = 64
+# The content of the header that marks the start of the next source in a batch
+SCAN_MARKER = "cbob_scan_marker"
 
 class DepGraph(object):
+    # Files are the integer ids given by the `cbob.headers` registry, which also keeps their paths
+    # and mtimes. The includes are kept in two arrays, CSR-style: the ids included by node `i` are
+    # `edge_targets[edge_starts[i]:edge_starts[i + 1]]`. That's a few bytes per file and include,
+    # instead of an object with a set for each file.
     def __init__(self, target):
         self.target = target
+        with span("build dependency graph", target=target.display_name), target.project.scan_lock:
+            self._build(target)
 
+    def _build(self, target):
         source_nodes = []
-        header_node_index = {}
-        # This is somewhat straight-forward if you have ever written a stream-parser (like SAX) in that we maintain a stack
-        # of where we currently sit in the tree.
-        # It adds a twist, though, in that we save references to processed nodes in a set. It may be a bit unintuitive that
-        # we only skip a node if it was in another node's dependencies - but note how, when we process a node, we don't add
-        # an edge to that very node, but to the node one layer *down* in the stack. Think about it for a while, then it makes
-        # sense.
-        processed_nodes = set()
-
-        get_dep_info = partial(_get_dep_info, gcc_path=target.project.gcc_path)
-        for file_path, deps in target.worker_pool.imap_unordered(get_dep_info, target.sources):
-            node = SourceNode(file_path, self)
-            source_nodes.append(node)
-            parent_nodes_stack = [node]
-
-            includes = []
-
-            for current_depth, dep_path in deps:
-                includes.append("#include \"" + dep_path + "\"\n")
-                node.add_include(dep_path)
-                if dep_path in header_node_index:
-                    current_node = header_node_index[dep_path]
-                    if current_node in processed_nodes:
-                        continue
-                    processed_nodes |= current_node.dependencies
-                else:
-                    current_node = HeaderNode(dep_path)
-                    header_node_index[dep_path] = current_node
-
-                parent_nodes_stack[:] = parent_nodes_stack[:current_depth]
-                parent_nodes_stack[-1].dependencies.add(current_node)
-                parent_nodes_stack.append(current_node)
+        # Header path -> id, all system headers map to the id of the toolchain
+        self.headers = {}
+        self.registry = registry = cbob.headers.current
+        # Edges are collected as `parent << 32 | child`, which dedups the includes seen by every source
+        edges = set()
+        # Headers of the toolchain are all represented by one node, and what they include is skipped
+        scan_cmd = target.scan_cmd
+        system_include_dirs = system_include_dirs_of(scan_cmd[0], target.project)
+        system_prefixes = tuple(include_dir + os.sep for include_dir in system_include_dirs)
 
+        # Sources already scanned (the same way) for another target in this run aren't scanned again
+        hash_output = target.rebuild_check == "preprocessed"
+        self._scan_key = (scan_cmd, hash_output)
+        self._system_prefixes = system_prefixes
+        scan_results = registry.scan_results
+        scan_batch = partial(_scan_batch, scan_cmd=scan_cmd, hash_output=hash_output, target=target)
+        already_scanned = [(file_path, scan_results[scan_cmd, hash_output, file_path]) for file_path in target.sources if (scan_cmd, hash_output, file_path) in scan_results]
+        unscanned = [file_path for file_path in target.sources if (scan_cmd, hash_output, file_path) not in scan_results]
+        batches = _batches(unscanned, target.local_jobs or os.cpu_count() or 1)
+        if any(len(batch) > 1 for batch in batches):
+            # Before the workers might race to create the marker files
+            target.project.scan_marker_paths
+        for file_path, result in chain(already_scanned, chain.from_iterable(target.local_pool.imap_unordered(scan_batch, batches))):
+            scan_results[scan_cmd, hash_output, file_path] = result
+            deps, preprocessed_hash = result
+            with registry.lock:
+                node = self._add_source(file_path, deps, registry, edges, system_prefixes, system_include_dirs)
+            node.preprocessed_hash = preprocessed_hash
+            source_nodes.append(node)
             node.finalize()
         self.roots = source_nodes
 
-def _get_dep_info(file_path, gcc_path):
+        edge_starts = array("i", bytes(4 * (len(registry.paths) + 1)))
+        edge_targets = array("i")
+        for edge in sorted(edges):
+            edge_starts[(edge >> 32) + 1] += 1
+            edge_targets.append(edge & 0xffffffff)
+        for node_id in range(len(edge_starts) - 1):
+            edge_starts[node_id + 1] += edge_starts[node_id]
+        self.edge_starts = edge_starts
+        self.edge_targets = edge_targets
+
+    def _add_source(self, file_path, deps, registry, edges, system_prefixes, system_include_dirs):
+        node = SourceNode(file_path, self, registry.file_id(file_path))
+        # Where we currently sit in the tree, like a SAX parser would
+        parent_stack = [node.id]
+        system_depth = None
+        system_dirs = set()
+        for current_depth, dep_path in deps:
+            if system_depth is not None:
+                if current_depth > system_depth:
+                    if dep_path.startswith(system_prefixes):
+                        system_dirs.add(os.path.dirname(dep_path))
+                    continue
+                system_depth = None
+            node.add_include(dep_path)
+            parent_stack[:] = parent_stack[:current_depth]
+            if system_prefixes and dep_path.startswith(system_prefixes):
+                # Only the system headers included by the project's own files make it into the
+                # precompiled header, the others may not even be included directly.
+                system_depth = current_depth
+                system_dirs.add(os.path.dirname(dep_path))
+                toolchain_id = registry.toolchain_id(system_include_dirs)
+                self.headers[dep_path] = toolchain_id
+                edges.add(parent_stack[-1] << 32 | toolchain_id)
+                continue
+            header_id = registry.file_id(dep_path)
+            # (Sources can be included too)
+            self.headers[dep_path] = header_id
+            edges.add(parent_stack[-1] << 32 | header_id)
+            parent_stack.append(header_id)
+        if system_dirs:
+            registry.add_toolchain_dirs(registry.toolchain_id(system_include_dirs), system_dirs)
+        return node
+
+    def includes(self, node_id):
+        return self.edge_targets[self.edge_starts[node_id]:self.edge_starts[node_id + 1]]
+
+    def system_headers(self, source_path):
+        # All the toolchain's headers the source includes, directly or not (the graph only has the
+        # toolchain itself)
+        deps = self.registry.scan_results[self._scan_key + (source_path,)][0]
+        return sorted({dep_path for current_depth, dep_path in deps if self._system_prefixes and dep_path.startswith(self._system_prefixes)})
+
+    def content_hash(self, path):
+        # Of a header or a source, system headers too (which get their own id for this)
+        import cbob.hashing
+        return self.registry.content_hash(self.registry.file_id(path), cbob.hashing.get(self.target.project, self.target.content_hashes))
+
+    def max_mtimes(self):
+        # The newest mtime of every node and all it includes, directly or not. Includes can be
+        # cyclic, so this finds the strongly connected components (Tarjan's algorithm, without
+        # recursion), which are completed included-first - one linear pass over the graph.
+        edge_starts, edge_targets = self.edge_starts, self.edge_targets
+        # (Other graphs may have added files to the registry since)
+        node_count = len(edge_starts) - 1
+        mtimes = self.registry.mtimes[:node_count]
+        max_mtimes = array("q", mtimes)
+        index = array("i", bytes(4 * node_count))
+        lowlink = array("i", bytes(4 * node_count))
+        on_stack = bytearray(node_count)
+        component_stack = []
+        next_index = 1
+        for root_id in (node.id for node in self.roots):
+            if index[root_id]:
+                continue
+            index[root_id] = lowlink[root_id] = next_index
+            next_index += 1
+            component_stack.append(root_id)
+            on_stack[root_id] = 1
+            work = [[root_id, edge_starts[root_id]]]
+            while work:
+                entry = work[-1]
+                node_id, position = entry
+                if position < edge_starts[node_id + 1]:
+                    entry[1] += 1
+                    child_id = edge_targets[position]
+                    if not index[child_id]:
+                        index[child_id] = lowlink[child_id] = next_index
+                        next_index += 1
+                        component_stack.append(child_id)
+                        on_stack[child_id] = 1
+                        work.append([child_id, edge_starts[child_id]])
+                    elif on_stack[child_id] and index[child_id] < lowlink[node_id]:
+                        lowlink[node_id] = index[child_id]
+                    continue
+                work.pop()
+                if work and lowlink[node_id] < lowlink[work[-1][0]]:
+                    lowlink[work[-1][0]] = lowlink[node_id]
+                if lowlink[node_id] != index[node_id]:
+                    continue
+                # `node_id` is the first of a component. What its members include outside of it
+                # is done already, members only have their own mtime yet (<= the newest of them).
+                members = []
+                while True:
+                    member_id = component_stack.pop()
+                    on_stack[member_id] = 0
+                    members.append(member_id)
+                    if member_id == node_id:
+                        break
+                newest = 0
+                for member_id in members:
+                    newest = max(newest, mtimes[member_id], max((max_mtimes[child_id] for child_id in self.includes(member_id)), default=0))
+                for member_id in members:
+                    max_mtimes[member_id] = newest
+        return max_mtimes
+
+    def mark_dirty(self, dirty_sources, dirty_headers):
+        max_mtimes = self.max_mtimes()
+        stat_cache = cbob.stat_cache.current
+        for node in self.roots:
+            try:
+                object_mtime = stat_cache.mtime_ns(node.object_path)
+            except OSError:
+                object_mtime = 0
+            header_max_mtime = max((max_mtimes[header_id] for header_id in self.includes(node.id)), default=0)
+            if max(max_mtimes[node.id], header_max_mtime) <= object_mtime:
+                continue
+            if not node.include_paths:
+                dirty_sources.append((node.path, node.object_path, None))
+                continue
+            dirty_sources.append((node.path, node.object_path, node.h_path))
+            try:
+                gch_mtime = stat_cache.mtime_ns(node.gch_path)
+            except OSError:
+                gch_mtime = 0
+            if header_max_mtime > gch_mtime:
+                dirty_headers.append((node.h_path, node.gch_path, None))
+
+def _batches(file_paths, jobs):
+    # As few processes as possible, but at least one batch for every worker
+    size = max(1, min(MAX_SCAN_BATCH, -(-len(file_paths) // jobs)))
+    return [file_paths[i:i + size] for i in range(0, len(file_paths), size)]
+
+def _scan(files, name, scan_cmd, target, hash_output=False):
+    # Returns the return code, the headers and, with `hash_output`, a hash of the preprocessed text
+    # for every source - in batches, the text of the next source starts after each marker line.
     import subprocess
+    import threading
+    from hashlib import sha256 as hashfn
     from os.path import normpath
+    from cbob.build_log import wait
     # The options used:
     # * -H: prints the dotted header information
     # * -w: suppressed warnings
     # * -E: makes GCC stop after the preprocessing (no compilation)
     # * -P: removes comments
-    cmd = (gcc_path, "-H", "-w", "-E", "-P", file_path)
+    cmd = tuple(scan_cmd) + ("-H", "-w", "-E", "-P") + tuple(files)
     # For some reason gcc outputs the header information over `stderr`.
     # Not that this is documented anywhere ...
-    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True) as process:
-        out, err = process.communicate()
-    # The output looks like
-    #     . inc1.h
-    #     .. inc1inc1.h
-    #     . inc2.h
-    # etc., with inc1inc1.h being included by inc1.h. In other words, the number of dots
-    # indicates the level of nesting. Also, there are lots of lines of no interest to us.
-    # Let's ignore them.
-    raw_deps = (line.partition(" ") for line in err.split("\n") if line and line[0] == ".")
-    deps = [(len(dots), normpath(rest)) for (dots, sep, rest) in raw_deps]
-    return file_path, deps
+    # Unless it's hashed, the preprocessed output itself (easily megabytes for C++) is of no
+    # interest, so it goes straight to /dev/null instead of through Python.
+    build_log = target.build_log
+    start = build_log.now() if build_log is not None else 0
+    deps = []
+
+    def parse_headers(stream):
+        # The output looks like
+        #     . inc1.h
+        #     .. inc1inc1.h
+        #     . inc2.h
+        # etc., with inc1inc1.h being included by inc1.h. In other words, the number of dots
+        # indicates the level of nesting. Also, there are lots of lines of no interest to us.
+        # Let's ignore them.
+        for line in stream:
+            if line[:1] == b".":
+                dots, sep, rest = line.decode(errors="replace").rstrip("\n").partition(" ")
+                deps.append((len(dots), normpath(rest)))
+
+    hashes = [hashfn()] if len(files) == 1 else []
+    with span(name, "scan", target=target.display_name, cmd=cmd), counters.job(target), \
+            counters.popen(cmd, stdout=subprocess.PIPE if hash_output else subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+        if hash_output:
+            # Both pipes need draining at the same time, or GCC gets stuck writing to a full one
+            header_reader = threading.Thread(target=parse_headers, args=(process.stderr,))
+            header_reader.start()
+            marker_line = (SCAN_MARKER + "\n").encode()
+            for line in process.stdout:
+                if line == marker_line:
+                    hashes.append(hashfn())
+                elif hashes:
+                    hashes[-1].update(line)
+            header_reader.join()
+        else:
+            parse_headers(process.stderr)
+        return_code, max_rss = wait(process)
+    if build_log is not None:
+        build_log.record("scan", start, return_code, max_rss, cmd, name)
+    return return_code, deps, [digest.hexdigest() for digest in hashes] if hash_output else None
+
+def _get_dep_info(file_path, scan_cmd, target, hash_output=False):
+    returncode, deps, hashes = _scan((file_path,), file_path, scan_cmd, target, hash_output)
+    return file_path, (deps, hashes[0] if hash_output else None)
+
+def _scan_batch(file_paths, scan_cmd, target, hash_output=False):
+    if len(file_paths) == 1:
+        return [_get_dep_info(file_paths[0], scan_cmd, target, hash_output)]
+    # GCC preprocesses its inputs one after the other, so their `-H` output comes in the same order.
+    # Where one ends and the next begins is marked by a file that only includes the marker header.
+    marker_source_path, marker_header_path = target.project.scan_marker_paths
+    name = "{} (+{} more)".format(file_paths[0], len(file_paths) - 1)
+    returncode, deps, hashes = _scan([path for file_path in file_paths for path in (marker_source_path, file_path)], name, scan_cmd, target, hash_output)
+    results = []
+    for current_depth, dep_path in deps:
+        if current_depth == 1 and dep_path == marker_header_path:
+            results.append([])
+        elif results:
+            results[-1].append((current_depth, dep_path))
+    if returncode != 0 or len(results) != len(file_paths) or (hash_output and len(hashes) != len(file_paths)):
+        # Let the culprit be reported on its own
+        logging.debug("batched scan failed, scanning {} files one by one".format(len(file_paths)))
+        return [_get_dep_info(file_path, scan_cmd, target, hash_output) for file_path in file_paths]
+    return list(zip(file_paths, zip(results, hashes if hash_output else [None] * len(file_paths))))
@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+from os.path import join, realpath
+import re
+import threading
+import time
+
+import cbob.counters as counters
+from cbob.toolchain import read_fields, write_fields
+
+# Digests of file contents, for the keys of the object cache. They're remembered in
+# `.cbob/objects/digests`, a line per file: `<path>\t<inode>\t<size>\t<mtime in ns>\t<digest>`,
+# so a file is only read again once it changed.
+#
+# If xxHash is installed, it's used instead of SHA-256 (which is a lot slower, and not needed for
+# telling files apart). Digests are prefixed with the name of their algorithm, so they never mix -
+# but machines with and without xxHash won't find each other's objects in a shared cache.
+#
+# Targets can take the digests of tracked files from the git index instead (see `GitDigests`).
+# Those are git's blob ids, and files that have to be hashed after all are hashed like git does.
+
+try:
+    import xxhash
+    ALGORITHM = "xxh3_128"
+except ImportError:
+    xxhash = None
+    ALGORITHM = "sha256"
+
+# Files changed less than this long ago might change again without their mtime changing (on
+# filesystems with coarse timestamps), their digests aren't remembered
+RACY_SECONDS = 2
+
+_stores = {}
+_lock = threading.Lock()
+
+def _new_hash(algorithm, f):
+    if algorithm == "git":
+        digest = hashlib.sha1()
+        digest.update(b"blob %d\0" % os.fstat(f.fileno()).st_size)
+        return digest
+    return xxhash.xxh3_128() if algorithm == "xxh3_128" else hashlib.sha256()
+
+def hash_file(path, algorithm=ALGORITHM):
+    with open(path, "rb") as f:
+        digest = _new_hash(algorithm, f)
+        if hasattr(hashlib, "file_digest"):
+            hashlib.file_digest(f, lambda: digest)
+        else:
+            for chunk in iter(lambda: f.read(1 << 18), b""):
+                digest.update(chunk)
+        counters.current.add(bytes_read=f.tell())
+    return "{}:{}".format(algorithm, digest.hexdigest())
+
+class DigestStore(object):
+    algorithm = ALGORITHM
+
+    def __init__(self, path):
+        self.path = path
+        self._digests = {fields[0]: tuple(fields[1:]) for fields in read_fields(path) if len(fields) == 5}
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def digest(self, path, stat, algorithm=ALGORITHM):
+        key = (str(stat.st_ino), str(stat.st_size), str(stat.st_mtime_ns))
+        known = self._digests.get(path)
+        if known is not None and known[:3] == key and known[3].startswith(algorithm + ":"):
+            return known[3]
+        digest = hash_file(path, algorithm)
+        if stat.st_mtime_ns < (time.time() - RACY_SECONDS) * 1e9:
+            with self._lock:
+                self._digests[path] = key + (digest,)
+                self._changed = True
+        return digest
+
+    def save(self):
+        with self._lock:
+            if self._changed:
+                write_fields(self.path, [(path,) + fields for path, fields in sorted(self._digests.items())])
+                self._changed = False
+
+# An entry of `git ls-files --stage --debug -z`
+_GIT_INDEX_ENTRY = re.compile(
+    rb"(\d+) ([0-9a-f]+) (\d)\t([^\0]*)\0"
+    rb"  ctime: \d+:\d+\n  mtime: (\d+):(\d+)\n  dev: \d+\tino: (\d+)\n  uid: \d+\tgid: \d+\n  size: (\d+)\tflags: [0-9a-f]+\n")
+
+def _git(root_path, *args):
+    import subprocess
+    from cbob.counters import popen
+    with popen(("git", "-C", root_path) + args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        out = process.communicate()[0]
+    if process.returncode != 0:
+        raise OSError("'git {}' failed in '{}'".format(args[0], root_path))
+    return out
+
+def _read_git_index(root_path):
+    # Absolute path -> the stat data in the index (mtime seconds and nanoseconds, inode, size) and blob id
+    top_level, git_dir = os.fsdecode(_git(root_path, "rev-parse", "--show-toplevel", "--absolute-git-dir")).splitlines()
+    index_mtime_ns = os.stat(join(git_dir, "index")).st_mtime_ns
+    blobs = {}
+    for match in _GIT_INDEX_ENTRY.finditer(_git(top_level, "ls-files", "--stage", "--debug", "-z")):
+        mode, blob, stage, path, seconds, nanoseconds, inode, size = match.groups()
+        seconds, nanoseconds = int(seconds), int(nanoseconds)
+        # Entries as new as the index itself are "racily clean": the file may have changed in the
+        # same tick without its stat data changing (git itself checks their content, too).
+        racy = seconds * 10**9 + nanoseconds >= index_mtime_ns if nanoseconds else seconds >= index_mtime_ns // 10**9
+        if stage != b"0" or mode not in (b"100644", b"100755") or racy:
+            continue
+        blobs[join(top_level, os.fsdecode(path))] = (seconds, nanoseconds, int(inode), int(size), blob.decode())
+    return blobs
+
+class GitDigests(object):
+    # Tracked files whose stat data still matches the git index get the blob id recorded there,
+    # everything else goes through the `DigestStore` (hashed like git would).
+    algorithm = "git"
+
+    def __init__(self, root_path, store):
+        self._store = store
+        try:
+            self._blobs = _read_git_index(root_path)
+        except (OSError, ValueError) as e:
+            logging.warning("can't read the git index of '{}' ({}) - hashing all files".format(root_path, e))
+            self._blobs = {}
+
+    def digest(self, path, stat):
+        entry = self._blobs.get(realpath(path))
+        if entry is not None:
+            seconds, nanoseconds, inode, size, blob = entry
+            # The index only keeps the lower 32 bits (and no nanoseconds on some systems)
+            if (seconds == stat.st_mtime_ns // 10**9
+                    and nanoseconds in (0, stat.st_mtime_ns % 10**9)
+                    and inode in (0, stat.st_ino & 0xffffffff)
+                    and size == stat.st_size & 0xffffffff):
+                return "git:" + blob
+        return self._store.digest(path, stat, "git")
+
+def get(project, backend="files"):
+    path = join(project.dirs.objects, "digests")
+    with _lock:
+        if path not in _stores:
+            _stores[path] = DigestStore(path)
+        if backend == "git":
+            if (path, backend) not in _stores:
+                _stores[path, backend] = GitDigests(project.root_path, _stores[path])
+            return _stores[path, backend]
+        return _stores[path]
@@ -0,0 +1,81 @@
+from array import array
+import sys
+import threading
+
+import cbob.stat_cache
+
+# The files known to the dependency graphs of this run. Each one gets an integer id, and is stat'd
+# (and maybe hashed) only once, however many targets - of the project, its dependencies or its
+# subprojects - include it. The graphs themselves only keep ids and includes (which depend on each
+# target's flags).
+
+# The path standing in for all headers of a toolchain (see `DepGraph._build`). Its mtime is the
+# newest of the directories its headers were seen in: installing or upgrading a header replaces it,
+# which changes its directory. A header rewritten in place (not many package managers do that)
+# still goes unnoticed until something else makes its sources dirty. The object cache's keys hash
+# the system headers themselves, though, so objects from the cache always match them.
+TOOLCHAIN_PATH = "<system headers>"
+
+class HeaderRegistry(object):
+    def __init__(self):
+        self.paths = []
+        self.mtimes = array("q")
+        self._ids = {}
+        self._content_hashes = {}
+        self._toolchain_dirs = {}
+        # The dependency scans done during this run, shared by all targets that have a source in common
+        self.scan_results = {}
+        # Held by a graph while it adds the files of a source (and while adding a file anyway)
+        self.lock = threading.RLock()
+
+    def _add(self, key, path, mtime):
+        node_id = len(self.paths)
+        self.paths.append(path)
+        self.mtimes.append(mtime)
+        self._ids[key] = node_id
+        return node_id
+
+    def file_id(self, path):
+        node_id = self._ids.get(path)
+        if node_id is None:
+            with self.lock:
+                node_id = self._ids.get(path)
+                if node_id is None:
+                    path = sys.intern(path)
+                    node_id = self._add(path, path, cbob.stat_cache.current.mtime_ns(path))
+        return node_id
+
+    def toolchain_id(self, include_dirs):
+        # The toolchain's headers only change along with it, so it's as new as the newest of its
+        # include directories - instead of a node (and a stat call) for each of the hundreds of headers.
+        key = (TOOLCHAIN_PATH,) + tuple(include_dirs)
+        node_id = self._ids.get(key)
+        if node_id is None:
+            node_id = self._add(key, TOOLCHAIN_PATH, 0)
+            self.add_toolchain_dirs(node_id, include_dirs)
+        return node_id
+
+    def add_toolchain_dirs(self, node_id, dir_paths):
+        # The directories (like `sys/` or `bits/`) the toolchain's headers were seen in
+        known_dirs = self._toolchain_dirs.setdefault(node_id, set())
+        for dir_path in set(dir_paths) - known_dirs:
+            try:
+                self.mtimes[node_id] = max(self.mtimes[node_id], cbob.stat_cache.current.mtime_ns(dir_path))
+            except OSError:
+                pass
+            known_dirs.add(dir_path)
+
+    def content_hash(self, node_id, digests):
+        # (One per algorithm)
+        key = (node_id, digests.algorithm)
+        if key not in self._content_hashes:
+            path = self.paths[node_id]
+            self._content_hashes[key] = digests.digest(path, cbob.stat_cache.current.stat(path))
+        return self._content_hashes[key]
+
+current = HeaderRegistry()
+
+def reset():
+    global current
+    current = HeaderRegistry()
+    return current
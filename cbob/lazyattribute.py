@@ -12,8 +12,9 @@ class lazy_attribute(object):
         return value
 
     def __set__(self, obj, new_value):
+        # Setting it to `None` resets it, so it's computed anew the next time.
         assert(new_value == None)
-        setattr(obj, self._value_name, None)
+        obj.__dict__.pop(self._value_name, None)
 
 
 
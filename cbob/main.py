@@ -1,141 +1,242 @@
 import argparse
 import logging
+import sys
 
 import cbob.commands as commands
 
-def main():
+def _add_init_parser(subparsers):
+    parser = subparsers.add_parser("init", help="Initalize cbob for your project.")
+    parser.set_defaults(func=commands.init)
+
+def _add_new_parser(subparsers):
+    parser = subparsers.add_parser("new", help="Create new target.")
+    parser.add_argument("name", help="The target's name.")
+    parser.set_defaults(func=commands.new)
+
+def _add_delete_parser(subparsers):
+    parser = subparsers.add_parser("delete", help="Delete a target.")
+    parser.add_argument("name", help="The target's name.")
+    parser.set_defaults(func=commands.delete)
+
+def _add_add_parser(subparsers):
+    parser = subparsers.add_parser("add", help="Add file(s) to a target.")
+    parser.add_argument("-t", "--target", help="The target to be added to (omit to add to default target).")
+    parser.add_argument("files", metavar="file", nargs="+", help="The file(s) to be added (wildcards allowed).")
+    parser.set_defaults(func=commands.add)
+
+def _add_remove_parser(subparsers):
+    parser = subparsers.add_parser("remove", help="Remove file(s) from a target.")
+    parser.add_argument("-t", "--target", help="The target the files will be removed from (omit to remove from default target).")
+    parser.add_argument("files", metavar="file", nargs="+", help="The file(s) to be removed (wildcards allowed).")
+    parser.set_defaults(func=commands.remove)
+
+def _add_info_parser(subparsers):
+    parser = subparsers.add_parser("info", help="Show information about the project.")
+    parser.add_argument("-a", "--all", dest="all_", action="store_true", help="Show all available information.")
+    parser.add_argument("-t", "--targets", action="store_true", help="List the project's targets.")
+    parser.add_argument("-s", "--subprojects", action="store_true", help="List the project's subprojects.")
+    parser.set_defaults(func=commands.info)
+
+def _add_list_parser(subparsers):
+    parser = subparsers.add_parser("list", help="List sources of target.")
+    parser.add_argument("-t", "--target", help="The inquired target (omit to show info about default target).")
+    parser.set_defaults(func=commands.list_)
+
+def _add_build_parser(subparsers):
+    from cbob.definitions import CACHE_MODES
+    parser = subparsers.add_parser("build", help="Build one, many or all targets.")
+    parser.add_argument("-t", "--target", help="The target to build (omit to build the default target).")
+    parser.add_argument("-j", "--jobs", type=int, help="The target to build.")
+    parser.add_argument("--link-jobs", type=int, help="The number of links running in parallel (default: 2).")
+    parser.add_argument("--variants", metavar="variant,...", help="Build these variants side by side (each selects the choices of the options named like it, e.g. 'debug,release').")
+    parser.add_argument("-o", "--oneshot", action="store_true", help="Build all sources, no matter what (shortcuts dependency resolution).")
+    parser.add_argument("-k", "--keep-going", dest="keep_going", action="store_true", help="Try to limb along even when compile errors happen.")
+    parser.add_argument("--stats", action="store_true", help="Print how many processes, stat calls and bytes read the build took, and the time spent in each phase.")
+    parser.add_argument("--trace", metavar="file", help="Write a trace of the build in Chrome's trace-event format (viewable with Perfetto or chrome://tracing).")
+    parser.add_argument("--metrics-file", metavar="file", help="Write metrics of the build in the Prometheus text format (for the node exporter's textfile collector).")
+    parser.add_argument("--workers", metavar="host[:port],...", help="Compile on these 'cbob worker's (in addition to the local jobs).")
+    parser.add_argument("--cache", metavar="url", help="Fetch objects from (and store them in) the object cache at 'url' (e.g. a 'python -m cbob.cache_server').")
+    parser.add_argument("--cache-mode", default="read-write", choices=CACHE_MODES, help="Whether newly compiled objects are stored in the cache (default: 'read-write').")
+    shard_group = parser.add_mutually_exclusive_group()
+    shard_group.add_argument("--shard", metavar="i/N", help="Only compile the i-th of N shares of the sources to compile (split by their recorded compile times) and write the objects to a bundle next to the binary, instead of linking.")
+    shard_group.add_argument("--merge", metavar="bundle", nargs="+", help="Install the objects of these bundles (made with '--shard') before building, so only what they don't cover is compiled.")
+    parser.set_defaults(func=commands.build)
+
+def _add_stats_parser(subparsers):
+    parser = subparsers.add_parser("stats", help="Summarize the recorded builds of a target.")
+    parser.add_argument("-t", "--target", help="The inquired target (omit to mean the default target).")
+    parser.add_argument("-n", "--count", type=int, default=10, help="How many builds and translation units to show (default: 10).")
+    parser.set_defaults(func=commands.stats)
+
+def _add_analyze_parser(subparsers):
+    parser = subparsers.add_parser("analyze", help="Show which headers cause how much rebuilding.")
+    parser.add_argument("-t", "--target", help="The inquired target (omit to mean the default target).")
+    parser.add_argument("-n", "--count", type=int, default=20, help="How many headers to show (default: 20).")
+    parser.add_argument("-s", "--sort", default="rebuild", choices=("rebuild", "dependents", "fanout"), help="Sort by estimated rebuild time, number of dependent sources or number of includes (default: 'rebuild').")
+    parser.add_argument("-p", "--parse-times", dest="parse_times", action="store_true", help="Also measure how long the compiler takes to parse each shown header.")
+    parser.set_defaults(func=commands.analyze)
+
+def _add_clean_parser(subparsers):
+    parser = subparsers.add_parser("clean", help="Clean out various parts.")
+    parser.add_argument("-t", "--target", help="The target to be cleaned (omit to clean default target).")
+    parser.add_argument("-a", "--all", dest="all_", action="store_true", help="Clean everything.")
+    parser.add_argument("-o", "--objects", action="store_true", help="Clean object files.")
+    parser.add_argument("-p", "--precompiled", action="store_true", help="Clean precompiled header files.")
+    parser.add_argument("-b", "--bin", dest="bin_", action="store_true", help="Clean binary files.")
+    parser.set_defaults(func=commands.clean)
+
+def _add_configure_parser(subparsers):
+    from cbob.definitions import TARGET_KINDS, REBUILD_CHECKS, CONTENT_HASHES, LINKERS
+    parser = subparsers.add_parser("configure", help="Set parameter(s) for a target.")
+    parser.add_argument("-t", "--target", help="The target to configure.")
+    parser.add_argument("-a", "--auto", action="store_true", help="Let cbob figure things out automatically (enabled if no other argument is given).")
+    parser.add_argument("-f", "--force", action="store_true", help="Force overwriting previous configuration when '--auto' is used.")
+    parser.add_argument("-c", "--compiler", help="The path to the compiler binary (e.g. '--compiler=\"/usr/bin/gcc\"').")
+    parser.add_argument("-b", "--bindir", help="The path to the output directory for binaries (e.g. '--bindir=\"out/\"').")
+    parser.add_argument("-l", "--linker", choices=("auto",) + tuple(LINKERS), help="The linker to use ('auto' tries all that are installed and picks the fastest; '--auto' does that as well if no linker is configured yet).")
+    parser.add_argument("-k", "--kind", choices=TARGET_KINDS, help="What to build: an executable (the default), a static library ('lib<target>.a', as thin archive) or a shared library ('lib<target>.so'). Dependents link against libraries automatically.")
+    parser.add_argument("-r", "--rebuild-check", dest="rebuild_check", choices=REBUILD_CHECKS, help="Recompile changed sources always ('mtime', the default) or only if their preprocessed text changed ('preprocessed': comment and blank line edits cost a scan, but no compile - debug info may point to shifted lines then).")
+    parser.add_argument("--content-hashes", dest="content_hashes", choices=CONTENT_HASHES, help="Where the object cache keys' hashes of sources and headers come from: the files ('files', the default) or, for tracked files without changes, the git index ('git': saves reading them in big checkouts).")
+    parser.set_defaults(func=commands.configure)
+
+def _add_subprojects_parser(subparsers):
+    parser = subparsers.add_parser("subprojects", help="Manage subprojects.")
+    subprojects_subparsers = parser.add_subparsers(help="Invoke command.")
+    add_parser = subprojects_subparsers.add_parser("add", help="Add projects as subprojects.")
+    add_parser.add_argument("projects", metavar="project", nargs="+", help="The path(s) to the sub-projects.")
+    add_parser.set_defaults(func=commands.subprojects_add)
+
+    remove_parser = subprojects_subparsers.add_parser("remove", help="Remove subprojects from project.")
+    remove_parser.add_argument("projects", metavar="project", nargs="+", help="The path(s) to the sub-projects.")
+    remove_parser.set_defaults(func=commands.subprojects_remove)
+
+def _add_dependencies_parser(subparsers):
+    parser = subparsers.add_parser("dependencies", help="Manage dependencies.")
+    dependencies_subparsers = parser.add_subparsers(help="Invoke command.")
+    add_parser = dependencies_subparsers.add_parser("add", help="Add a dependency on other targets.")
+    add_parser.add_argument("-t", "--target", help="The target that requires the dependencies (omit to mean default target).")
+    add_parser.add_argument("dependencies", metavar="dependency", nargs="+", help="The target(s) to be added as dependencies.")
+    add_parser.set_defaults(func=commands.dependencies_add)
+
+    remove_parser = dependencies_subparsers.add_parser("remove", help="Remove a dependency.")
+    remove_parser.add_argument("-t", "--target", help="The target to remove the dependency from (omit to mean default target).")
+    remove_parser.add_argument("dependencies", metavar="dependency", nargs="+", help="The dependency target(s) to be removed.")
+    remove_parser.set_defaults(func=commands.dependencies_remove)
+
+    list_parser = dependencies_subparsers.add_parser("list", help="List dependencies.")
+    list_parser.add_argument("-t", "--target", help="The target to list the dependencies of (omit to mean default target).")
+    list_parser.set_defaults(func=commands.dependencies_list)
+
+def _add_plugins_parser(subparsers):
+    parser = subparsers.add_parser("plugins", help="Manage plugins.")
+    plugin_subparsers = parser.add_subparsers(help="Invoke command.")
+    add_parser = plugin_subparsers.add_parser("add", help="Register Python plugin(s) for a target.")
+    add_parser.add_argument("-t", "--target", help="The target for the plugin (omit to mean the default target).")
+    add_parser.add_argument("plugins", nargs="+", help="The path to the plugin(s).")
+    add_parser.set_defaults(func=commands.plugins_add)
+
+    remove_parser = plugin_subparsers.add_parser("remove", help="Unregister Python plugin(s) from a target.")
+    remove_parser.add_argument("-t", "--target", help="The target for the plugin (omit to mean the default target).")
+    remove_parser.add_argument("plugins", nargs="+", help="The path to the plugin(s).")
+    remove_parser.set_defaults(func=commands.plugins_remove)
+
+    list_parser = plugin_subparsers.add_parser("list", help="List Python plugins of a target.")
+    list_parser.add_argument("-t", "--target", help="The target of the plugins (omit to mean the default target).")
+    list_parser.set_defaults(func=commands.plugins_list)
+
+def _add_options_parser(subparsers):
+    parser = subparsers.add_parser("options", help="Manage options.")
+    options_subparsers = parser.add_subparsers(help="Invoke command.")
+    new_parser = options_subparsers.add_parser("new", help="Create a new configuration option for a target.")
+    new_parser.add_argument("-t", "--target", help="The target the option belongs to (omit to mean the default target).")
+    new_parser.add_argument("-c", "--choices", nargs="+", help="Possible choices for that option (default: 'on off').")
+    new_parser.add_argument("name", help="The name of the option.")
+    new_parser.set_defaults(func=commands.options_new)
+
+    edit_parser = options_subparsers.add_parser("edit", help="Edit the flags of a configuration option.")
+    edit_parser.add_argument("-t", "--target", help="The target the option belongs to (omit to mean the default target).")
+    edit_parser.add_argument("-c", "--choice", default="on", help="The choice to edit (e.g. 'off', default: 'on'.")
+    edit_parser.add_argument("-e", "--editor", help="The editor to use (default: $EDITOR, fallback: '/usr/bin/vi').")
+    edit_parser.add_argument("-a", "--add", default="ask", choices=("yes", "no", "ask"), help="Create the choice if it doesn't exist (default: 'ask').")
+    edit_parser.add_argument("option", help="The name of the option to edit.")
+    edit_parser.set_defaults(func=commands.options_edit)
+
+    info_parser = options_subparsers.add_parser("info", help="Print information about the options of a target.")
+    info_parser.add_argument("-t", "--target", help="The target that is inquired about (omit to mean the default target).")
+    info_parser.set_defaults(func=commands.options_info)
+
+    list_parser = options_subparsers.add_parser("list", help="Print information about a specific option of a target.")
+    list_parser.add_argument("-t", "--target", help="The target that is inquired about (omit to mean the default target).")
+    list_parser.add_argument("option", help="The option that is inquired about.")
+    list_parser.set_defaults(func=commands.options_list)
+
+def _add_worker_parser(subparsers):
+    parser = subparsers.add_parser("worker", help="Compile for other machines' 'cbob build --workers ...'.")
+    parser.add_argument("--host", default="localhost", help="The address to listen on (default: 'localhost'; use '0.0.0.0' for all interfaces).")
+    parser.add_argument("-p", "--port", type=int, help="The port to listen on (default: 3632; 0 picks a free one).")
+    parser.add_argument("-j", "--jobs", type=int, help="The number of compilers to run in parallel (default: number of CPUs).")
+    parser.set_defaults(func=commands.worker)
+
+# The order of this dict is the order in which the commands show up in `cbob --help`.
+COMMAND_PARSERS = {
+    "init": _add_init_parser,
+    "new": _add_new_parser,
+    "delete": _add_delete_parser,
+    "add": _add_add_parser,
+    "remove": _add_remove_parser,
+    "info": _add_info_parser,
+    "list": _add_list_parser,
+    "build": _add_build_parser,
+    "stats": _add_stats_parser,
+    "analyze": _add_analyze_parser,
+    "clean": _add_clean_parser,
+    "configure": _add_configure_parser,
+    "subprojects": _add_subprojects_parser,
+    "dependencies": _add_dependencies_parser,
+    "plugins": _add_plugins_parser,
+    "options": _add_options_parser,
+    "worker": _add_worker_parser,
+}
+
+def _requested_command(argv):
+    # The global options are all flags (or take their value with '='), so the first positional argument is the command.
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+    return None
+
+def _normalize_profile_option(argv):
+    # `--profile` takes an optional value, which argparse would happily take the command for. So the value
+    # has to be given as `--profile=file`, and a bare `--profile` means the default file.
+    from cbob.profiling import DEFAULT_PROFILE_PATH
+    return ["--profile=" + DEFAULT_PROFILE_PATH if arg == "--profile" else arg for arg in argv]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--profile" in argv:
+        argv = _normalize_profile_option(argv)
+
     main_parser = argparse.ArgumentParser(description="cbob builds your project.", prog="cbob")
     verbosity = main_parser.add_mutually_exclusive_group()
     verbosity.add_argument("-v", "--verbose", help="print more verbose output", action="store_const", const=logging.INFO, dest="verbosity", default=logging.WARNING)
     verbosity.add_argument("-q", "--quiet", help="be silent", action="store_const", const=logging.ERROR, dest="verbosity", default=logging.WARNING)
     verbosity.add_argument("--debug", help="print lots of debug output", action="store_const", const=logging.DEBUG, dest="verbosity", default=logging.WARNING)
-    
+    main_parser.add_argument("--profile", metavar="file", help="profile cbob itself and write the profile to 'file' (default: 'cbob.prof'; pstats, or collapsed stacks of all threads if 'file' ends with '.folded')")
+
     subparsers = main_parser.add_subparsers(help="Invoke command.")
 
-    parsers = {}
-
-    parsers["init"] = subparsers.add_parser("init", help="Initalize cbob for your project.")
-    parsers["init"].set_defaults(func=commands.init)
-
-    parsers["new"] = subparsers.add_parser("new", help="Create new target.")
-    parsers["new"].add_argument("name", help="The target's name.")
-    parsers["new"].set_defaults(func=commands.new)
-
-    parsers["delete"] = subparsers.add_parser("delete", help="Delete a target.")
-    parsers["delete"].add_argument("name", help="The target's name.")
-    parsers["delete"].set_defaults(func=commands.delete)
-
-    parsers["add"] = subparsers.add_parser("add", help="Add file(s) to a target.")
-    parsers["add"].add_argument("-t", "--target", help="The target to be added to (omit to add to default target).")
-    parsers["add"].add_argument("files", metavar="file", nargs="+", help="The file(s) to be added (wildcards allowed).")
-    parsers["add"].set_defaults(func=commands.add)
-
-    parsers["remove"] = subparsers.add_parser("remove", help="Remove file(s) from a target.")
-    parsers["remove"].add_argument("-t", "--target", help="The target the files will be removed from (omit to remove from default target).")
-    parsers["remove"].add_argument("files", metavar="file", nargs="+", help="The file(s) to be removed (wildcards allowed).")
-    parsers["remove"].set_defaults(func=commands.remove)
-
-    parsers["info"] = subparsers.add_parser("info", help="Show information about the project.")
-    parsers["info"].add_argument("-a", "--all", dest="all_", action="store_true", help="Show all available information.")
-    parsers["info"].add_argument("-t", "--targets", action="store_true", help="List the project's targets.")
-    parsers["info"].add_argument("-s", "--subprojects", action="store_true", help="List the project's subprojects.")
-    parsers["info"].set_defaults(func=commands.info)
-
-    parsers["list"] = subparsers.add_parser("list", help="List sources of target.")
-    parsers["list"].add_argument("-t", "--target", help="The inquired target (omit to show info about default target).")
-    parsers["list"].set_defaults(func=commands.list_)
-
-    parsers["build"] = subparsers.add_parser("build", help="Build one, many or all targets.")
-    parsers["build"].add_argument("-t", "--target", help="The target to build (omit to build the default target).")
-    parsers["build"].add_argument("-j", "--jobs", type=int, help="The target to build.")
-    parsers["build"].add_argument("-o", "--oneshot", action="store_true", help="Build all sources, no matter what (shortcuts dependency resolution).")
-    parsers["build"].add_argument("-k", "--keep-going", dest="keep_going", action="store_true", help="Try to limb along even when compile errors happen.")
-    parsers["build"].set_defaults(func=commands.build)
-
-    parsers["clean"] = subparsers.add_parser("clean", help="Clean out various parts.")
-    parsers["clean"].add_argument("-t", "--target", help="The target to be cleaned (omit to clean default target).")
-    parsers["clean"].add_argument("-a", "--all", dest="all_", action="store_true", help="Clean everything.")
-    parsers["clean"].add_argument("-o", "--objects", action="store_true", help="Clean object files.")
-    parsers["clean"].add_argument("-p", "--precompiled", action="store_true", help="Clean precompiled header files.")
-    parsers["clean"].add_argument("-b", "--bin", dest="bin_", action="store_true", help="Clean binary files.")
-    parsers["clean"].set_defaults(func=commands.clean)
-
-    parsers["configure"] = subparsers.add_parser("configure", help="Set parameter(s) for a target.")
-    parsers["configure"].add_argument("-t", "--target", help="The target to configure.")
-    parsers["configure"].add_argument("-a", "--auto", action="store_true", help="Let cbob figure things out automatically (enabled if no other argument is given).")
-    parsers["configure"].add_argument("-f", "--force", action="store_true", help="Force overwriting previous configuration when '--auto' is used.")
-    parsers["configure"].add_argument("-c", "--compiler", nargs=1, help="The path to the compiler binary (e.g. '--compiler=\"/usr/bin/gcc\"').")
-    parsers["configure"].add_argument("-b", "--bindir", nargs=1, help="The path to the output directory for binaries (e.g. '--bindir=\"out/\"').")
-    parsers["configure"].set_defaults(func=commands.configure)
-
-    parsers["subprojects"] = subparsers.add_parser("subprojects", help="Manage subprojects.")
-    subprojects_subparsers = parsers["subprojects"].add_subparsers(help="Invoke command.")
-    parsers["subprojects_add"] = subprojects_subparsers.add_parser("add", help="Add projects as subprojects.")
-    parsers["subprojects_add"].add_argument("projects", metavar="project", nargs="+", help="The path(s) to the sub-projects.")
-    parsers["subprojects_add"].set_defaults(func=commands.subprojects_add)
-
-    parsers["subprojects_remove"] = subprojects_subparsers.add_parser("remove", help="Remove subprojects from project.")
-    parsers["subprojects_remove"].add_argument("projects", metavar="project", nargs="+", help="The path(s) to the sub-projects.")
-    parsers["subprojects_remove"].set_defaults(func=commands.subprojects_remove)
-
-    parsers["dependencies"] = subparsers.add_parser("dependencies", help="Manage dependencies.")
-    dependencies_subparsers = parsers["dependencies"].add_subparsers(help="Invoke command.")
-    parsers["dependencies_add"] = dependencies_subparsers.add_parser("add", help="Add a dependency on other targets.")
-    parsers["dependencies_add"].add_argument("-t", "--target", help="The target that requires the dependencies (omit to mean default target).")
-    parsers["dependencies_add"].add_argument("dependencies", metavar="dependency", nargs="+", help="The target(s) to be added as dependencies.")
-    parsers["dependencies_add"].set_defaults(func=commands.dependencies_add)
-
-    parsers["dependencies_remove"] = dependencies_subparsers.add_parser("remove", help="Remove a dependency.")
-    parsers["dependencies_remove"].add_argument("-t", "--target", help="The target to remove the dependency from (omit to mean default target).")
-    parsers["dependencies_remove"].add_argument("dependencies", metavar="dependency", nargs="+", help="The dependency target(s) to be removed.")
-    parsers["dependencies_remove"].set_defaults(func=commands.dependencies_remove)
-
-    parsers["dependencies_list"] = dependencies_subparsers.add_parser("list", help="List dependencies.")
-    parsers["dependencies_list"].add_argument("-t", "--target", help="The target to list the dependencies of (omit to mean default target).")
-    parsers["dependencies_list"].set_defaults(func=commands.dependencies_list)
-
-    parsers["plugins"] = subparsers.add_parser("plugins", help="Manage plugins.")
-    plugin_subparsers = parsers["plugins"].add_subparsers(help="Invoke command.")
-    parsers["plugins_add"] = plugin_subparsers.add_parser("add", help="Register Python plugin(s) for a target.")
-    parsers["plugins_add"].add_argument("-t", "--target", help="The target for the plugin (omit to mean the default target).")
-    parsers["plugins_add"].add_argument("plugins", nargs="+", help="The path to the plugin(s).")
-    parsers["plugins_add"].set_defaults(func=commands.plugins_add)
-
-    parsers["plugins_remove"] = plugin_subparsers.add_parser("remove", help="Unregister Python plugin(s) from a target.")
-    parsers["plugins_remove"].add_argument("-t", "--target", help="The target for the plugin (omit to mean the default target).")
-    parsers["plugins_remove"].add_argument("plugins", nargs="+", help="The path to the plugin(s).")
-    parsers["plugins_remove"].set_defaults(func=commands.plugins_remove)
-
-    parsers["plugins_list"] = plugin_subparsers.add_parser("list", help="List Python plugins of a target.")
-    parsers["plugins_list"].add_argument("-t", "--target", help="The target of the plugins (omit to mean the default target).")
-    parsers["plugins_list"].set_defaults(func=commands.plugins_list)
-
-    parsers["options"] = subparsers.add_parser("options", help="Manage options.")
-    options_subparsers = parsers["options"].add_subparsers(help="Invoke command.")
-    parsers["options_new"] = options_subparsers.add_parser("new", help="Create a new configuration option for a target.")
-    parsers["options_new"].add_argument("-t", "--target", help="The target the option belongs to (omit to mean the default target).")
-    parsers["options_new"].add_argument("-c", "--choices", nargs="+", help="Possible choices for that option (default: 'on off').")
-    parsers["options_new"].add_argument("name", help="The name of the option.")
-    parsers["options_new"].set_defaults(func=commands.options_new)
-
-    parsers["options_edit"] = options_subparsers.add_parser("edit", help="Edit the flags of a configuration option.")
-    parsers["options_edit"].add_argument("-t", "--target", help="The target the option belongs to (omit to mean the default target).")
-    parsers["options_edit"].add_argument("-c", "--choice", default="on", help="The choice to edit (e.g. 'off', default: 'on'.")
-    parsers["options_edit"].add_argument("-e", "--editor", help="The editor to use (default: $EDITOR, fallback: '/usr/bin/vi').")
-    parsers["options_edit"].add_argument("-a", "--add", default="ask", choices=("yes", "no", "ask"), help="Create the choice if it doesn't exist (default: 'ask').")
-    parsers["options_edit"].add_argument("option", help="The name of the option to edit.")
-    parsers["options_edit"].set_defaults(func=commands.options_edit)
-
-    parsers["options_info"] = options_subparsers.add_parser("info", help="Print information about the options of a target.")
-    parsers["options_info"].add_argument("-t", "--target", help="The target that is inquired about (omit to mean the default target).")
-    parsers["options_info"].set_defaults(func=commands.options_info)
-
-    parsers["options_list"] = options_subparsers.add_parser("list", help="Print information about a specific option of a target.")
-    parsers["options_list"].add_argument("-t", "--target", help="The target that is inquired about (omit to mean the default target).")
-    parsers["options_list"].add_argument("option", help="The option that is inquired about.")
-    parsers["options_list"].set_defaults(func=commands.options_list)
-
-    args, extra = main_parser.parse_known_args()
+    # Setting up all the subparsers costs more than most commands need to run, so only the
+    # requested one is built. Without a (known) command we build all of them, so that `--help`
+    # and the error message for a mistyped command are complete.
+    command = _requested_command(argv)
+    if command in COMMAND_PARSERS:
+        COMMAND_PARSERS[command](subparsers)
+    else:
+        for add_parser in COMMAND_PARSERS.values():
+            add_parser(subparsers)
+
+    args, extra = main_parser.parse_known_args(argv)
 
     logging.basicConfig(format="cbob: %(message)s")
     logger = logging.getLogger()
@@ -146,13 +247,18 @@ def main():
     try:
         func = args.func
         argdict = vars(args)
+        profile_path = argdict.pop("profile")
         del argdict["verbosity"]
         del argdict["func"]
         if "args" in argdict:
             extra += argdict["args"]
             del argdict["args"]
         if extra:
-            func(args=extra, **argdict)
+            argdict["args"] = extra
+        if profile_path is not None:
+            from functools import partial
+            import cbob.profiling
+            cbob.profiling.run(partial(func, **argdict), profile_path)
         else:
             func(**argdict)
     except CbobError as e:
@@ -0,0 +1,65 @@
+import os
+
+# Writes the counters of a build in the Prometheus text format, for the textfile collector of the
+# node exporter (or anything else that understands OpenMetrics-ish text files).
+
+PHASES = ("total", "scan", "dirty_check", "cache", "pch", "compile", "link")
+SOURCE_STATES = ("dirty", "cached", "skipped")
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(key, **extra):
+    project_name, target_name = key
+    labels = [("project", project_name), ("target", target_name)] + sorted(extra.items())
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + "}"
+
+def _metric(lines, name, help_text, samples):
+    lines.append("# HELP {} {}".format(name, help_text))
+    lines.append("# TYPE {} gauge".format(name))
+    for labels, value in samples:
+        lines.append("{}{} {}".format(name, labels, value))
+
+def format_metrics(build_counters):
+    targets = build_counters.targets
+    counts = build_counters.counts
+    lines = []
+    _metric(lines, "cbob_build_phase_seconds", "Time spent in each phase of the last build.", [
+        (_labels(key, phase=phase_name), "{:.6f}".format(build_counters.phases[key, phase_name]))
+        for key in targets for phase_name in PHASES if (key, phase_name) in build_counters.phases])
+
+    source_samples = []
+    for key in targets:
+        dirty = counts.get((key, "dirty"), 0)
+        numbers = {
+            "dirty": dirty,
+            "cached": counts.get((key, "cached"), 0),
+            # Sources that needed compiling, but weren't because the build stopped at an error
+            "skipped": dirty - counts.get((key, "compiled"), 0) - counts.get((key, "cache_hits"), 0)}
+        source_samples += [(_labels(key, state=state), numbers[state]) for state in SOURCE_STATES]
+    _metric(lines, "cbob_build_sources", "Number of sources by state in the last build.", source_samples)
+
+    _metric(lines, "cbob_build_pch_builds", "Number of precompiled headers built in the last build.",
+            [(_labels(key), counts.get((key, "pch_builds"), 0)) for key in targets])
+    _metric(lines, "cbob_build_failures", "Number of failed compiler and linker runs in the last build.",
+            [(_labels(key), counts.get((key, "failures"), 0)) for key in targets])
+    _metric(lines, "cbob_build_cache_requests", "Number of objects looked up in the object cache in the last build.",
+            [(_labels(key, result=result), counts.get((key, name), 0)) for key in targets for result, name in (("hit", "cache_hits"), ("miss", "cache_misses"))])
+    _metric(lines, "cbob_build_remote_compiles", "Number of sources compiled by 'cbob worker's in the last build.",
+            [(_labels(key), counts.get((key, "remote_compiles"), 0)) for key in targets])
+    _metric(lines, "cbob_build_peak_parallelism", "Highest number of jobs running at the same time in the last build.",
+            [(_labels(key), build_counters.peak_jobs.get(key, 0)) for key in targets])
+
+    results = build_counters.results
+    _metric(lines, "cbob_build_success", "Whether the last build succeeded (1) or failed (0).",
+            [(_labels(key), int(results[key][0])) for key in targets if key in results])
+    _metric(lines, "cbob_build_last_run_timestamp_seconds", "When the last build finished.",
+            [(_labels(key), "{:.3f}".format(results[key][1])) for key in targets if key in results])
+    return "\n".join(lines) + "\n"
+
+def write(build_counters, path):
+    # The collector may read the file at any time, so it must never see a half-written one
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(format_metrics(build_counters))
+    os.replace(tmp_path, path)
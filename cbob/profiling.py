@@ -0,0 +1,147 @@
+from collections import Counter
+import os
+from os.path import basename, dirname, abspath
+import sys
+import threading
+import time
+
+CBOB_DIR = dirname(abspath(__file__))
+DEFAULT_PROFILE_PATH = "cbob.prof"
+# Output files with these extensions get collapsed stacks (as used by flamegraph.pl or speedscope)
+# from the sampling profiler, everything else gets pstats from cProfile.
+COLLAPSED_EXTENSIONS = (".folded", ".collapsed")
+TOP_COUNT = 15
+
+# Where cbob sits waiting for its child processes (or for the workers waiting for theirs). This is not
+# the overhead we're after, so it's reported separately.
+_WAITING_BUILTINS = ("wait4", "waitpid", "'acquire' of '_thread.lock", "'poll' of 'select.poll", "posix.read", "select.select")
+_WAITING_MODULES = frozenset(("subprocess.py", "threading.py", "selectors.py", "queue.py", "pool.py"))
+_WAITING_FUNCTIONS = frozenset(((os.path.join(CBOB_DIR, "build_log.py"), "wait"),))
+
+def _is_cbob_file(filename):
+    return filename.startswith(CBOB_DIR + os.sep) and not filename.endswith("profiling.py")
+
+def _short_name(filename, lineno, funcname):
+    if _is_cbob_file(filename):
+        filename = os.path.relpath(filename, dirname(CBOB_DIR))
+    return "{}:{}({})".format(filename, lineno, funcname)
+
+def run(func, output_path):
+    if output_path.endswith(COLLAPSED_EXTENSIONS):
+        profiler = Sampler()
+    else:
+        profiler = _CProfiler()
+    start = time.perf_counter()
+    profiler.start()
+    try:
+        return func()
+    finally:
+        profiler.stop()
+        wall_time = time.perf_counter() - start
+        profiler.write(output_path)
+        print("cbob profile (written to '{}', {:.3f} s total):".format(output_path, wall_time), file=sys.stderr)
+        for line in profiler.summary(TOP_COUNT):
+            print("  " + line, file=sys.stderr)
+
+class _CProfiler(object):
+    # cProfile only sees the main thread, which is where cbob does its bookkeeping; the workers
+    # mostly wait for compilers, which shows up as waiting for the worker pool here.
+    def __init__(self):
+        import cProfile
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def write(self, path):
+        self._profile.dump_stats(path)
+
+    def summary(self, count):
+        import pstats
+        stats = pstats.Stats(self._profile).stats
+        waiting_time = 0
+        own_time = 0
+        own_functions = []
+        for (filename, lineno, funcname), (primitive_calls, calls, self_time, cumulative_time, callers) in stats.items():
+            if filename == "~" and any(name in funcname for name in _WAITING_BUILTINS):
+                waiting_time += self_time
+            elif _is_cbob_file(filename):
+                own_time += self_time
+                own_functions.append((self_time, cumulative_time, calls, _short_name(filename, lineno, funcname)))
+        own_functions.sort(reverse=True)
+        lines = ["waiting for child processes and workers: {:.3f} s".format(waiting_time),
+                 "in cbob's own functions: {:.3f} s".format(own_time),
+                 "{:>10} {:>12} {:>8}  function".format("own", "cumulative", "calls")]
+        for self_time, cumulative_time, calls, name in own_functions[:count]:
+            lines.append("{:9.3f}s {:11.3f}s {:8}  {}".format(self_time, cumulative_time, calls, name))
+        return lines
+
+class Sampler(object):
+    # A minimal sampling profiler: a thread that looks at the stacks of all other threads every
+    # `interval` seconds, so that (unlike with cProfile) the worker threads are covered as well.
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = Counter()
+        self._rounds = 0
+        self._elapsed = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cbob-profiler", daemon=True)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self._elapsed = time.perf_counter() - self._start
+
+    @property
+    def seconds_per_sample(self):
+        # Sampling takes time itself, so the real interval is somewhat longer than the requested one
+        return self._elapsed / self._rounds if self._rounds else self.interval
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            self._rounds += 1
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                stack.append((thread_names.get(ident, "thread"), 0, ""))
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as output_file:
+            for stack, samples in self.stacks.items():
+                frames = [stack[0][0]] + [_short_name(*frame) for frame in stack[1:]]
+                output_file.write("{} {}\n".format(";".join(frames).replace(" ", "_"), samples))
+
+    def summary(self, count):
+        waiting_samples = 0
+        own_samples = Counter()
+        for stack, samples in self.stacks.items():
+            filename, lineno, funcname = stack[-1]
+            if basename(filename) in _WAITING_MODULES or (filename, funcname) in _WAITING_FUNCTIONS:
+                waiting_samples += samples
+                continue
+            # Time spent in library code counts for the cbob function that called it
+            for filename, lineno, funcname in reversed(stack[1:]):
+                if _is_cbob_file(filename):
+                    own_samples[_short_name(filename, lineno, funcname)] += samples
+                    break
+        lines = ["waiting for child processes and workers (summed over all threads): {:.3f} s".format(waiting_samples * self.seconds_per_sample),
+                 "in cbob's own functions: {:.3f} s".format(sum(own_samples.values()) * self.seconds_per_sample),
+                 "{:>10} {:>8}  function".format("own", "samples")]
+        for name, samples in own_samples.most_common(count):
+            lines.append("{:9.3f}s {:8}  {}".format(samples * self.seconds_per_sample, samples, name))
+        return lines
@@ -1,6 +1,7 @@
 import logging
 import os
-from os.path import normpath, join, isdir, dirname, basename, abspath, islink, commonprefix, relpath, expanduser
+import threading
+from os.path import normpath, join, isdir, dirname, basename, abspath, islink, isfile, commonprefix, relpath, expanduser
 
 from cbob.helpers import read_symlink, make_rel_symlink, print_information, log_summary
 from cbob.paths import DirNamespace
@@ -26,7 +27,10 @@ class Project(object):
         self.name = basename(self.root_path)
         self.dirs = DirNamespace(join(self.root_path, ".cbob"), {
             "subprojects": "subprojects",
-            "targets": "targets"})
+            "targets": "targets",
+            "objects": "objects"})
+        # Variants of a target are built side by side - only one of them scans, the others reuse its results
+        self.scan_lock = threading.Lock()
 
     @lazy_attribute
     def targets(self):
@@ -44,14 +48,41 @@ class Project(object):
 
     @lazy_attribute
     def gcc_path(self):
-        try:
-            import subprocess
-            gcc_path = subprocess.check_output(('which', 'gcc'), universal_newlines=True).strip()
-        except subprocess.CalledProcessError as e:
+        # Looking it up ourselves saves spawning `which` for every build.
+        import shutil
+        gcc_path = shutil.which("gcc")
+        if gcc_path is None:
             from cbob.error import CbobError
-            raise CbobError("GCC wasn't found ('which gcc' wasn't successful") from e
+            raise CbobError("GCC wasn't found (it's not in any directory in $PATH)")
         return gcc_path
 
+    @lazy_attribute
+    def scan_marker_paths(self):
+        # See `cbob.dep_graph._scan_batch`
+        from cbob.dep_graph import SCAN_MARKER
+        source_path = join(self.root_path, ".cbob", "scan_marker.c")
+        header_path = normpath(join(self.root_path, ".cbob", "scan_marker.h"))
+        try:
+            with open(header_path) as header_file:
+                up_to_date = header_file.read() == SCAN_MARKER + "\n"
+        except OSError:
+            up_to_date = False
+        if not up_to_date or not isfile(source_path):
+            with open(header_path, "w") as header_file:
+                header_file.write(SCAN_MARKER + "\n")
+            with open(source_path, "w") as source_file:
+                source_file.write("#include \"{}\"\n".format(header_path))
+        return source_path, header_path
+
+    @lazy_attribute
+    def ar_path(self):
+        import shutil
+        ar_path = shutil.which("ar")
+        if ar_path is None:
+            from cbob.error import CbobError
+            raise CbobError("ar wasn't found (it's not in any directory in $PATH), but it's needed for static libraries")
+        return ar_path
+
     def new_target(self, target_name):
         make_default = not islink(join(self.dirs.targets, "_default"))
         assert("." not in target_name) # subprojects should be handled by caller
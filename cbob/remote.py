@@ -0,0 +1,189 @@
+import json
+import logging
+import re
+import socket
+import struct
+import threading
+
+# Remote compilation, distcc-style: the coordinator (a regular `cbob build --workers ...`)
+# preprocesses a source locally and sends the result to a `cbob worker`, which compiles it and
+# sends back the object file. Precompiled headers and linking always stay local.
+#
+# Every message is a 4-byte length, a JSON header of that length and an (optional) payload, whose
+# length is given in the header.
+
+DEFAULT_PORT = 3632
+CONNECT_TIMEOUT = 5
+# Compiling may take a while, but a worker that doesn't answer at all is considered dead.
+COMPILE_TIMEOUT = 600
+
+# Workers only ever run things that look like a compiler
+_COMPILER_NAME = re.compile(r"^([\w.]+-)*(gcc|g\+\+|cc|c\+\+|clang|clang\+\+)(-[\d.]+)?$")
+# ... and only with flags that affect code generation (no plugins, no passing things on to the
+# assembler or linker, no paths)
+_CODEGEN_FLAG = re.compile(r"^-(O\w*|g\w*|f(?!plugin)[\w+-]+(=[\w,.+-]+)?|m[\w-]+(=[\w.-]+)?|W[\w+-]*(=\w+)?|w|pedantic|std=[\w+]+|pthread)$")
+
+def codegen_flags(flags):
+    # The flags that are sent along with a job, or None if some flag can't be used on a worker. The
+    # preprocessor flags have done their part already.
+    flags = [flag for flag in flags if not flag.startswith(("-D", "-U", "-I"))]
+    return flags if all(_CODEGEN_FLAG.match(flag) for flag in flags) else None
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def send_message(sock, header, payload=b""):
+    header = dict(header, size=len(payload))
+    header_bytes = json.dumps(header).encode()
+    sock.sendall(struct.pack("!I", len(header_bytes)) + header_bytes + payload)
+
+def receive_message(sock):
+    header_size, = struct.unpack("!I", _receive_exactly(sock, 4))
+    header = json.loads(_receive_exactly(sock, header_size).decode())
+    return header, _receive_exactly(sock, header["size"])
+
+def parse_address(address):
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        return address, DEFAULT_PORT
+    try:
+        return host, int(port)
+    except ValueError:
+        from cbob.error import CbobError
+        raise CbobError("'{}' is not a valid worker address (expected 'host[:port]').".format(address))
+
+def _request(address, header, payload=b"", timeout=COMPILE_TIMEOUT):
+    with socket.create_connection(parse_address(address), timeout=CONNECT_TIMEOUT) as sock:
+        sock.settimeout(timeout)
+        send_message(sock, header, payload)
+        return receive_message(sock)
+
+class RemoteWorkers(object):
+    # Hands out job slots, both on the workers and on the local machine. Remote slots are preferred,
+    # because preprocessing is cheap compared to compiling.
+    def __init__(self, addresses, local_jobs):
+        self._remote_slots = []
+        self._dead = set()
+        self._local_slots = local_jobs
+        self._condition = threading.Condition()
+        for address in addresses:
+            try:
+                header, _ = _request(address, {"type": "hello"}, timeout=CONNECT_TIMEOUT)
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("worker '{}' is not available ({}) - not using it".format(address, e))
+                continue
+            self._remote_slots += [address] * header["jobs"]
+
+    @property
+    def slots(self):
+        return len(self._remote_slots) + self._local_slots
+
+    def acquire(self, local_only=False):
+        # Returns the address of a worker, or None for a local slot.
+        with self._condition:
+            while True:
+                if self._remote_slots and not local_only:
+                    return self._remote_slots.pop()
+                if self._local_slots:
+                    self._local_slots -= 1
+                    return None
+                self._condition.wait()
+
+    def release(self, address):
+        with self._condition:
+            if address is None:
+                self._local_slots += 1
+            elif address not in self._dead:
+                self._remote_slots.append(address)
+            self._condition.notify()
+
+    def discard(self, address):
+        with self._condition:
+            self._dead.add(address)
+            self._remote_slots = [slot for slot in self._remote_slots if slot != address]
+
+    def compile(self, address, compiler_path, language, flags, preprocessed):
+        from os.path import basename
+        header, payload = _request(address, {
+            "type": "compile",
+            "compiler": basename(compiler_path),
+            "language": language,
+            "flags": flags}, preprocessed)
+        return header["returncode"], header["stderr"], payload
+
+current = None
+
+def connect(addresses, local_jobs):
+    global current
+    current = RemoteWorkers(addresses, local_jobs)
+    return current
+
+def disconnect():
+    global current
+    current = None
+
+def _compile_job(header, payload):
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    compiler_name = header.get("compiler", "")
+    compiler_path = shutil.which(compiler_name) if _COMPILER_NAME.match(compiler_name) else None
+    if compiler_path is None:
+        return {"returncode": 1, "stderr": "cbob worker: no compiler '{}' here\n".format(compiler_name)}, b""
+    flags = header.get("flags", [])
+    if not isinstance(flags, list) or codegen_flags(flags) != flags:
+        return {"returncode": 1, "stderr": "cbob worker: refusing flags {}\n".format(flags)}, b""
+    language = "c++-cpp-output" if header.get("language") == "C++" else "cpp-output"
+    with tempfile.TemporaryDirectory(prefix="cbob-worker-") as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input")
+        output_path = os.path.join(tmp_dir, "output.o")
+        with open(input_path, "wb") as input_file:
+            input_file.write(payload)
+        cmd = [compiler_path, "-x", language, "-c", input_path, "-o", output_path] + flags
+        process = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        result = {"returncode": process.returncode, "stderr": process.stderr.decode(errors="replace")}
+        if process.returncode != 0:
+            return result, b""
+        with open(output_path, "rb") as output_file:
+            return result, output_file.read()
+
+def serve(host, port, jobs):
+    import socketserver
+    job_slots = threading.BoundedSemaphore(jobs)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            try:
+                header, payload = receive_message(self.request)
+                if header.get("type") == "hello":
+                    send_message(self.request, {"jobs": jobs})
+                elif header.get("type") == "compile":
+                    with job_slots:
+                        result, output = _compile_job(header, payload)
+                    print("{}: {} ({} bytes in, {} bytes out)".format(
+                        self.client_address[0],
+                        "ok" if result["returncode"] == 0 else "failed",
+                        len(payload),
+                        len(output)), flush=True)
+                    send_message(self.request, result, output)
+            except (OSError, ValueError, KeyError) as e:
+                print("{}: broken request ({})".format(self.client_address[0], e), flush=True)
+
+    class Server(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    with Server((host, port), Handler) as server:
+        print("cbob worker listening on {}:{} ({} jobs)".format(host, server.server_address[1], jobs), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
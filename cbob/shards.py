@@ -0,0 +1,68 @@
+import heapq
+import io
+import json
+import os
+import tarfile
+
+# Splitting the compilation of a build over several machines: `cbob build --shard i/N` compiles
+# the i-th of N shares of the dirty sources and packs the objects into a bundle (a tar file with a
+# `manifest.json` and the objects, named like in the store), `cbob build --merge bundle...` unpacks
+# the bundles into the store and links.
+#
+# Every shard has to come up with the same split, so it only depends on what the machines have in
+# common: the (project-relative) names of the sources and their compile times recorded in the build
+# log by full builds, if the log is shared between them (sources without one weigh as much as the
+# average). Shard builds are marked in the log, their times aren't used.
+
+MANIFEST_NAME = "manifest.json"
+
+def parse_shard(text):
+    from cbob.error import CbobError
+    try:
+        index, count = map(int, text.split("/"))
+    except ValueError:
+        raise CbobError("'{}' is not a shard (like '1/4')".format(text)) from None
+    if not 1 <= index <= count:
+        raise CbobError("there's no shard {} of {}".format(index, count))
+    return index, count
+
+def split(weights, count):
+    # Longest processing time first: the heaviest remaining name goes to the lightest share. Ties
+    # are broken by name and number, so the split is the same everywhere.
+    shares = [[] for _ in range(count)]
+    loads = [(0.0, number) for number in range(count)]
+    for name in sorted(weights, key=lambda name: (-weights[name], name)):
+        load, number = heapq.heappop(loads)
+        shares[number].append(name)
+        heapq.heappush(loads, (load + weights[name], number))
+    return shares
+
+def write_bundle(bundle_path, manifest, object_paths):
+    tmp_path = "{}.{}.tmp".format(bundle_path, os.getpid())
+    with tarfile.open(tmp_path, "w") as bundle:
+        data = json.dumps(manifest, indent=1).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        bundle.addfile(info, io.BytesIO(data))
+        for object_path in object_paths:
+            bundle.add(object_path, "objects/" + os.path.basename(object_path))
+    os.replace(tmp_path, bundle_path)
+
+def read_manifests(bundle_paths):
+    # Target (display) name -> the bundles for it, with their manifests
+    from cbob.error import CbobError
+    bundles = {}
+    for bundle_path in bundle_paths:
+        try:
+            with tarfile.open(bundle_path) as bundle:
+                manifest = json.loads(bundle.extractfile(MANIFEST_NAME).read().decode())
+        except (OSError, KeyError, ValueError, tarfile.TarError) as e:
+            raise CbobError("'{}' is not an object bundle ({})".format(bundle_path, e)) from e
+        bundles.setdefault(manifest["target"], []).append((bundle_path, manifest))
+    return bundles
+
+def read_objects(bundle_path, manifest):
+    # Yields the names and contents of the bundle's objects
+    with tarfile.open(bundle_path) as bundle:
+        for name in manifest["objects"]:
+            yield name, bundle.extractfile("objects/" + name).read()
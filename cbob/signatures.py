@@ -0,0 +1,75 @@
+from os.path import join, relpath
+import threading
+
+from cbob.build_log import command_hash
+from cbob.toolchain import compiler_identity, read_fields, write_fields
+
+# Every object and precompiled header in a store is recorded with a signature of the command line
+# that produced it and of the compiler binary that ran it. An output whose signature doesn't match
+# the command that would produce it now is rebuilt, even if it is newer than all its inputs.
+#
+# The signatures of a store live in one file, a line per output: `<path in the store>\t<signature>`,
+# followed by `\t<hash of the preprocessed source>` for objects of targets that check that.
+# How compilers are identified is up to `cbob.toolchain`.
+
+_stores = {}
+_lock = threading.Lock()
+
+class Signatures(object):
+    def __init__(self, store_path, compiler_identity):
+        self.path = join(store_path, "signatures")
+        self._store_path = store_path
+        self._compiler_identity = compiler_identity
+        self._signatures = {}
+        self._preprocessed_hashes = {}
+        for fields in read_fields(self.path):
+            if len(fields) in (2, 3):
+                self._signatures[fields[0]] = fields[1]
+            if len(fields) == 3:
+                self._preprocessed_hashes[fields[0]] = fields[2]
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _signature(self, cmd):
+        return command_hash(list(cmd) + [self._compiler_identity])
+
+    def matches(self, output_path, cmd):
+        return self._signatures.get(relpath(output_path, self._store_path)) == self._signature(cmd)
+
+    def preprocessed_hash(self, output_path):
+        return self._preprocessed_hashes.get(relpath(output_path, self._store_path))
+
+    def record(self, output_path, cmd, preprocessed_hash=None):
+        signature = self._signature(cmd)
+        name = relpath(output_path, self._store_path)
+        with self._lock:
+            if self._signatures.get(name) != signature or self._preprocessed_hashes.get(name) != preprocessed_hash:
+                self._signatures[name] = signature
+                if preprocessed_hash is None:
+                    self._preprocessed_hashes.pop(name, None)
+                else:
+                    self._preprocessed_hashes[name] = preprocessed_hash
+                self._changed = True
+
+    def discard(self, output_path):
+        name = relpath(output_path, self._store_path)
+        with self._lock:
+            self._preprocessed_hashes.pop(name, None)
+            if self._signatures.pop(name, None) is not None:
+                self._changed = True
+
+    def save(self):
+        with self._lock:
+            if self._changed:
+                write_fields(self.path, [
+                    (name, signature) + ((self._preprocessed_hashes[name],) if name in self._preprocessed_hashes else ())
+                    for name, signature in sorted(self._signatures.items())])
+                self._changed = False
+
+def get(store_path, compiler_path, project):
+    # All targets using a store share its signatures (and the file they are saved to)
+    identity = compiler_identity(compiler_path, project)
+    with _lock:
+        if store_path not in _stores:
+            _stores[store_path] = Signatures(store_path, identity)
+        return _stores[store_path]
@@ -0,0 +1,71 @@
+import os
+import threading
+
+import cbob.counters as counters
+
+# The mtimes cbob looks at during a build, each asked for only once. Files are looked up in a
+# listing of their directory, made by one `os.scandir` the first time something in it is asked for:
+# network filesystems answer a listing with the attributes of all entries (NFS' READDIRPLUS), which
+# makes the stats that follow cheap. A file that isn't in the listing is stat'd itself, it may have
+# been made since (like a header generated by a plugin). Files that cbob writes itself are stat'd
+# anew after being `forget`ten.
+
+class StatCache(object):
+    def __init__(self):
+        self._listings = {}
+        self._stats = {}
+        self._forgotten = set()
+        self._lock = threading.Lock()
+
+    def _entry(self, path):
+        directory, name = os.path.split(path)
+        listing = self._listings.get(directory)
+        if listing is None:
+            with self._lock:
+                listing = self._listings.get(directory)
+                if listing is None:
+                    counters.current.add(stat_calls=1)
+                    try:
+                        with os.scandir(directory or os.curdir) as entries:
+                            listing = {entry.name: entry for entry in entries}
+                    except OSError:
+                        listing = {}
+                    self._listings[directory] = listing
+        return listing.get(name)
+
+    def stat(self, path):
+        # Raises `OSError` for missing files, like `os.stat`
+        result = self._stats.get(path)
+        if result is None:
+            counters.current.add(stat_calls=1)
+            if path in self._forgotten:
+                result = os.stat(path)
+            else:
+                entry = self._entry(path)
+                result = os.stat(path) if entry is None else entry.stat()
+            self._stats[path] = result
+        return result
+
+    def mtime_ns(self, path):
+        return self.stat(path).st_mtime_ns
+
+    def isfile(self, path):
+        entry = None if path in self._forgotten else self._entry(path)
+        if entry is None:
+            counters.current.add(stat_calls=1)
+            return os.path.isfile(path)
+        try:
+            return entry is not None and entry.is_file()
+        except OSError:
+            return False
+
+    def forget(self, path):
+        self._forgotten.add(path)
+        self._stats.pop(path, None)
+
+current = StatCache()
+
+def reset():
+    global current
+    current = StatCache()
+    return current
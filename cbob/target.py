@@ -1,32 +1,41 @@
-from collections import namedtuple
 from contextlib import contextmanager
 import logging
 from functools import partial
 import os
-from os.path import basename, join, islink, normpath, isdir, isfile, expandvars, split, splitext
-import subprocess
+from os.path import basename, join, islink, normpath, isdir, isfile, expandvars, splitext
 
 from cbob.helpers import read_symlink, make_rel_symlink, print_information, log_summary
-from cbob.definitions import SOURCE_FILE_EXTENSIONS, HOOKS, SYNONYMS
-from cbob.node import SourceNode, HeaderNode
+from cbob.definitions import SOURCE_FILE_EXTENSIONS, TARGET_KINDS, REBUILD_CHECKS, CONTENT_HASHES, LINKERS, HOOKS, SYNONYMS
 from cbob.paths import DirNamespace
 from cbob.lazyattribute import lazy_attribute
+from cbob.trace import span
+from cbob.counters import phase, popen
+import cbob.counters as counters
+import cbob.stat_cache as stat_cache
+
+# Links are memory hungry (and the faster linkers use several threads each), so only a few run at once
+DEFAULT_LINK_JOBS = 2
 
 class Target(object):
-    def __init__(self, path, project):
+    def __init__(self, path, project, variant=None):
         self.path = path
         self.name = basename(path)
         self.project = project
+        # A named build variant (like 'debug' or 'release'), which selects the choices of the options
+        self.variant = variant
+        self.display_name = self.name if variant is None else "{}@{}".format(self.name, variant)
         self._dep_graph = None
         self._worker_pool = None
         self._worker_jobs = None
+        self._local_pool = None
+        self._local_jobs = None
+        self.output_jobs = None
+        self.build_log = None
         self.dirs = DirNamespace(path, {
             "sources": "sources",
             "dependencies": "dependencies",
             "options": "options",
-            "plugins": "plugins",
-            "objects": ".objects",
-            "precompiled_headers": ".precompiled_headers"})
+            "plugins": "plugins"})
 
     @lazy_attribute
     def sources(self):
@@ -37,7 +46,22 @@ class Target(object):
 
     @lazy_attribute
     def dependencies(self):
-        return {raw_dep_name: get_target(raw_dep_name) for raw_dep_name in os.listdir(self.dirs.dependencies)}
+        return {raw_dep_name: get_target(raw_dep_name).with_variant(self.variant) for raw_dep_name in os.listdir(self.dirs.dependencies)}
+
+    def with_variant(self, variant):
+        if variant == self.variant:
+            return self
+        return Target(self.path, self.project, variant)
+
+    @property
+    def state_path(self):
+        # Where the build state of the variant (its log, what it was linked against, ...) is kept
+        if self.variant is None:
+            return self.path
+        path = join(self.path, "variants", self.variant)
+        if not isdir(path):
+            os.makedirs(path, exist_ok=True)
+        return path
 
     @lazy_attribute
     def compiler(self):
@@ -49,21 +73,141 @@ class Target(object):
         with self.assume_configured():
             return os.readlink(join(self.path, "bin_dir"))
 
+    @lazy_attribute
+    def kind(self):
+        try:
+            return os.readlink(join(self.path, "kind"))
+        except OSError:
+            return "executable"
+
+    @lazy_attribute
+    def linker(self):
+        try:
+            return os.readlink(join(self.path, "linker"))
+        except OSError:
+            return "default"
+
+    @lazy_attribute
+    def rebuild_check(self):
+        try:
+            return os.readlink(join(self.path, "rebuild_check"))
+        except OSError:
+            return "mtime"
+
+    @lazy_attribute
+    def content_hashes(self):
+        try:
+            return os.readlink(join(self.path, "content_hashes"))
+        except OSError:
+            return "files"
+
+    @property
+    def scan_cmd(self):
+        # Comparing preprocessed texts only makes sense if they're preprocessed like for compiling.
+        # Otherwise any GCC will do, and the scans can be shared by all targets.
+        if self.rebuild_check == "preprocessed":
+            return (self.compiler,) + self.compile_flags
+        return (self.project.gcc_path,)
+
+    @property
+    def output_path(self):
+        if self.kind == "static":
+            file_name = "lib{}.a".format(self.name)
+        elif self.kind == "shared":
+            file_name = "lib{}.so".format(self.name)
+        else:
+            file_name = self.name
+        if self.variant is None:
+            return join(self.bin_dir, file_name)
+        return join(self.bin_dir, self.variant, file_name)
+
+    @lazy_attribute
+    def option_flags(self):
+        # Every option contributes the flags of one of its choices: the one named like the variant,
+        # 'on' if the option itself is named like the variant, and 'off' otherwise.
+        flags = []
+        for name, choices in sorted(self.options.items()):
+            if self.variant in choices:
+                choice = self.variant
+            elif name == self.variant and "on" in choices:
+                choice = "on"
+            elif "off" in choices:
+                choice = "off"
+            else:
+                continue
+            flags += [line.strip() for line in choices[choice] if line.strip() and not line.startswith("#")]
+        return tuple(flags)
+
+    @lazy_attribute
+    def compile_flags(self):
+        return (("-fPIC",) if self.kind == "shared" else ()) + self.option_flags
+
+    def selects_something(self, variant):
+        return any(variant in choices or (name == variant and "on" in choices) for name, choices in self.options.items())
+
+    @property
+    def store_path(self):
+        # Objects and precompiled headers live in a store shared by all targets of the project that
+        # compile with the same compiler and flags, so that a source belonging to several targets is
+        # only compiled once.
+        from hashlib import sha256 as hashfn
+        config = "\0".join((self.compiler,) + self.compile_flags)
+        return join(self.project.dirs.objects, hashfn(config.encode()).hexdigest()[:16])
+
+    @lazy_attribute
+    def objects_dir(self):
+        path = self.store_path
+        if not isdir(path):
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    @lazy_attribute
+    def precompiled_headers_dir(self):
+        path = join(self.store_path, "precompiled_headers")
+        if not isdir(path):
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    @lazy_attribute
+    def signatures(self):
+        import cbob.signatures
+        return cbob.signatures.get(self.objects_dir, self.compiler, self.project)
+
+    def object_path(self, source_path):
+        return join(self.objects_dir, splitext(self.project.mangle_path(source_path))[0] + ".o")
+
+    @property
+    def output_digest_path(self):
+        return join(self.state_path, "output_digest")
+
+    @property
+    def link_libraries(self):
+        # The libraries of the dependencies (and of theirs, as static libraries don't bring their
+        # own dependencies along), each after everything that needs it.
+        libraries = []
+        for dep_target in self.dependencies.values():
+            if dep_target.kind != "executable" and dep_target.sources:
+                libraries.append(dep_target)
+            libraries += dep_target.link_libraries
+        seen = set()
+        unique_libraries = []
+        for library in reversed(libraries):
+            if library.output_path not in seen:
+                seen.add(library.output_path)
+                unique_libraries.append(library)
+        return unique_libraries[::-1]
+
     @lazy_attribute
     def language(self):
         return self._guess_target_language()
 
     @lazy_attribute
     def plugins(self):
-        import imp
         plugins_dir = self.dirs.plugins
         plugins = {}
         for filename in os.listdir(plugins_dir):
             abs_filename = read_symlink(filename, plugins_dir)
-            path, filename = split(abs_filename)
-            name, ext = splitext(filename)
-            fp, fn, desc = imp.find_module(name, [path])
-            plugin_module = imp.load_module(name, fp, fn, desc)
+            plugin_module = _load_plugin(abs_filename)
             for hook, func in vars(plugin_module).items():
                 if hook in HOOKS:
                     if not hook in plugins:
@@ -82,6 +226,10 @@ class Target(object):
                     options[name][choice] = choice_f.readlines()
         return options
 
+    @property
+    def build_log_path(self):
+        return join(self.state_path, "build_log")
+
     @property
     def dep_graph(self):
         if self._dep_graph == None:
@@ -108,6 +256,16 @@ class Target(object):
             self._worker_pool.join()
             self._worker_pool = None
 
+    # Scans, precompiled headers and hashing always run on this machine, so with remote workers
+    # they get a pool of their own, sized by the local jobs only.
+    @property
+    def local_pool(self):
+        return self._local_pool if self._local_pool is not None else self.worker_pool
+
+    @property
+    def local_jobs(self):
+        return self._local_jobs if self._local_pool is not None else self.worker_jobs
+
     def _source_filetype_check(self, file_name, abs_file_path, symlink_path):
         if not splitext(file_name)[1] in SOURCE_FILE_EXTENSIONS:
             logging.warning("'{}' does not seem to be a C/C++ source file (ending is not one of {}).".format(file_name, ", ".join(SOURCE_FILE_EXTENSIONS)))
@@ -194,7 +352,7 @@ class Target(object):
             from cbob.error import CbobError
             raise CbobError("Option '{}' for target '{}' already exists.".format(name, self.name)) from e
         for choice in choices:
-            for word, synonyms in SYNONYMS:
+            for word, synonyms in SYNONYMS.items():
                 if choice in synonyms:
                     choice = word
                     break
@@ -205,7 +363,7 @@ class Target(object):
         if not isdir(option_dir):
             from cbob.error import OptionDoesntExistError 
             raise OptionDoesntExistError(self.name, option)
-        for word, synonyms in SYNONYMS:
+        for word, synonyms in SYNONYMS.items():
             if choice in synonyms:
                 choice = word
                 break
@@ -230,6 +388,7 @@ class Target(object):
                 editor = "/usr/bin/vi"
         import tempfile
         import shutil
+        import subprocess
         import sys
         with tempfile.NamedTemporaryFile(encoding=sys.stdout.encoding, mode="r+") as tmp_file, \
                 open(choice_filename, "r", encoding=sys.stdout.encoding) as choice_file:
@@ -244,9 +403,9 @@ class Target(object):
                 raise CbobError("Cancelled editing of option '{}'.".format(option))
             tmp_file.flush()
             tmp_file.seek(0)
-            new_flags = [line.strip() for line in tmp_file.readlines() if line and not line.startswith("#")]
+            new_flags = [line.strip() for line in tmp_file.readlines() if line.strip() and not line.startswith("#")]
         with open(choice_filename, "w", encoding=sys.stdout.encoding) as choice_file:
-            choice_file.writelines(new_flags)
+            choice_file.writelines(flag + "\n" for flag in new_flags)
 
 
     def options_info(self):
@@ -255,34 +414,180 @@ class Target(object):
     def options_list(self, option):
         print_information("Option '{}'".format(option), self.options[option])
 
-    def build(self, jobs, oneshot, keep_going):
+    def build(self, jobs, oneshot, keep_going, link_jobs=None, variants=None, shard=None, bundles=None):
+        from concurrent.futures import ThreadPoolExecutor
+        from multiprocessing.pool import ThreadPool
+        import threading
+        import cbob.remote
+        local_jobs = jobs
+        if cbob.remote.current is not None:
+            # Remote slots count as well (for compiling), the workers hand them out
+            jobs = cbob.remote.current.slots
+        targets = [self.with_variant(variant) for variant in variants] if variants else [self]
+        for target in targets:
+            if target.variant is not None and not target.selects_something(target.variant):
+                logging.warning("variant '{}' doesn't select a choice of any option of target '{}'".format(target.variant, self.name))
+        # All targets (and all variants) share one pool, so that `jobs` limits the whole build.
+        worker_pool = ThreadPool(jobs)
+        local_pool = ThreadPool(local_jobs) if jobs != local_jobs else worker_pool
+        # Links by target and variant, compilations by target and store (variants with the same
+        # flags share them)
+        futures = {}
+        compilations = {}
+        schedule_lock = threading.Lock()
+        try:
+            # Linking happens in the background, so that the links of targets that don't depend on
+            # each other run in parallel - with each other and with compiling the remaining targets.
+            with ThreadPoolExecutor(link_jobs or DEFAULT_LINK_JOBS, thread_name_prefix="cbob-link") as link_executor:
+                schedule_build = partial(Target._schedule_build,
+                        jobs=jobs,
+                        local_jobs=local_jobs,
+                        oneshot=oneshot,
+                        keep_going=keep_going,
+                        shard=shard,
+                        bundles=bundles,
+                        worker_pool=worker_pool,
+                        local_pool=local_pool,
+                        link_executor=link_executor,
+                        futures=futures,
+                        compilations=compilations,
+                        schedule_lock=schedule_lock,
+                        output_jobs=OutputJobs())
+                if len(targets) == 1:
+                    schedule_build(self)
+                else:
+                    # Variants are scheduled side by side, so that their compiles fill the pool together
+                    with ThreadPoolExecutor(len(targets), thread_name_prefix="cbob-variant") as variant_executor:
+                        for variant_future in [variant_executor.submit(schedule_build, target) for target in targets]:
+                            variant_future.result()
+                with schedule_lock:
+                    link_futures = list(futures.values())
+                for future in link_futures:
+                    future.result()
+        finally:
+            for pool in {worker_pool, local_pool}:
+                pool.close()
+                pool.join()
+
+    def _schedule_build(self, jobs, local_jobs, oneshot, keep_going, shard, bundles, worker_pool, local_pool, link_executor, futures, compilations, schedule_lock, output_jobs):
+        # Returns a future for the target's link, which its dependents wait for before linking.
+        # Variants are scheduled side by side, so looking up and adding futures go together.
+        from concurrent.futures import Future
+        with schedule_lock:
+            if (self.path, self.variant) in futures:
+                return futures[self.path, self.variant]
+            future = futures[self.path, self.variant] = Future()
+        try:
+            self._schedule_self(jobs, local_jobs, oneshot, keep_going, shard, bundles, worker_pool, local_pool, link_executor, futures, compilations, schedule_lock, output_jobs, future)
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        return future
+
+    def _schedule_self(self, jobs, local_jobs, oneshot, keep_going, shard, bundles, worker_pool, local_pool, link_executor, futures, compilations, schedule_lock, output_jobs, future):
+        self._worker_pool = worker_pool
+        self._worker_jobs = jobs
+        self._local_pool = local_pool
+        self._local_jobs = local_jobs
+        self.output_jobs = output_jobs
+        dep_futures = []
         for dep_name, dep_target in self.dependencies.items():
             logging.info("Building dependency '{}'.".format(dep_name))
-            dep_target.build(jobs, oneshot, keep_going)
-            logging.info("Done building dependency '{}'".format(dep_name))
-        self._build_self(jobs, oneshot, keep_going)
-
-    def _build_self(self, jobs, oneshot, keep_going):
+            dep_futures.append(dep_target._schedule_build(jobs, local_jobs, oneshot, keep_going, shard, bundles, worker_pool, local_pool, link_executor, futures, compilations, schedule_lock, output_jobs))
+            logging.info("Done compiling dependency '{}'".format(dep_name))
+        if not keep_going:
+            with schedule_lock:
+                done_futures = [other for other in futures.values() if other.done()]
+            for done_future in done_futures:
+                if done_future.exception() is not None:
+                    raise done_future.exception()
+        from cbob.build_log import BuildLog
+        import time
+        self.build_log = BuildLog(self.build_log_path)
+        start = time.perf_counter()
+        try:
+            compiled = self._compile_once(oneshot, keep_going, shard, bundles, compilations, schedule_lock)
+            link = None
+            if compiled is None:
+                pass
+            elif shard is not None:
+                # Linking is up to the build that merges the bundles
+                source_nodes, changed_objects, failed = compiled
+                self._write_bundle(shard, changed_objects, failed)
+            else:
+                # What's left is done once the dependencies are linked (see `_link_and_finish`)
+                link = partial(self._link, *compiled)
+        except BaseException:
+            self._finish_build(start, False)
+            raise
+        link_future = link_executor.submit(self._link_and_finish, link, dep_futures, start)
+        link_future.add_done_callback(partial(_copy_outcome, future))
+
+    def _compile_once(self, oneshot, keep_going, shard, bundles, compilations, schedule_lock):
+        # Variants that compile with the same flags (like those of a dependency without options)
+        # share a store, the first one to get here compiles for all of them.
+        from concurrent.futures import Future
+        key = (self.path, self.store_path) if self.sources else (self.path, self.variant)
+        with schedule_lock:
+            compilation = compilations.get(key)
+            compiling = compilation is None
+            if compiling:
+                compilation = compilations[key] = Future()
+        if not compiling:
+            logging.info("'{}' shares its objects with another variant".format(self.display_name))
+            return compilation.result()
+        try:
+            with span("build " + self.display_name, target=self.display_name):
+                compiled = self._build_self(oneshot, keep_going, shard, bundles)
+        except BaseException as e:
+            compilation.set_exception(e)
+            raise
+        compilation.set_result(compiled)
+        return compiled
+
+    def _link_and_finish(self, link, dep_futures, start):
+        succeeded = False
+        try:
+            for dep_future in dep_futures:
+                dep_future.result()
+            if link is not None:
+                link()
+            succeeded = True
+        finally:
+            self._finish_build(start, succeeded)
+
+    def _finish_build(self, start, succeeded):
+        import time
+        key = counters.target_key(self)
+        counters.current.add_phase_time(key, "total", time.perf_counter() - start)
+        counters.current.set_result(key, succeeded)
+        self.build_log.record("build", 0, 0 if succeeded else 1, 0, [self.name], self.name)
+        self.build_log.close()
+
+    def _build_self(self, oneshot, keep_going, shard=None, bundles=None):
         self.run_plugins("pre_build")
         # Bail out if there are no sources -
         # there is no need for a virtual target to be fully configured.
         sources = self.sources
         if not sources:
             logging.info("No sources - nothing to do.")
-            return
+            return None
         
         if self.compiler is None or self.bin_dir is None:
             from cbob.error import NotConfiguredError
             raise NotConfiguredError(self.name)
 
-        self.worker_jobs = jobs
-
         logging.info("calculating dependencies ...")
 
-        #source_nodes = self._calculate_dependencies()
-        source_nodes = self.dep_graph.roots
+        with phase(self, "scan"):
+            source_nodes = self.dep_graph.roots
         logging.info("done.")
 
+        installed_objects = []
+        if bundles and self.display_name in bundles:
+            installed_objects = self._install_bundles(bundles[self.display_name], source_nodes)
+
         logging.info("determining files for recompilation ...")
         dirty_sources = []
         dirty_headers = []
@@ -290,34 +595,168 @@ class Target(object):
         # Walk the dependency tree to find dirty sources and '.h'-files,
         # unless the oneshot option is given, in which case all sources and corresping '.h'-files
         # are marked for recompilation.
+        preprocessed_hashes = None
+        if self.rebuild_check == "preprocessed":
+            preprocessed_hashes = {node.object_path: node.preprocessed_hash for node in source_nodes}
         if not oneshot:
-            for source_node in source_nodes:
-                source_node.mark_dirty(dirty_sources, dirty_headers)
+            with phase(self, "dirty_check"):
+                self.dep_graph.mark_dirty(dirty_sources, dirty_headers)
+                self._mark_changed_commands(source_nodes, dirty_sources, dirty_headers)
+                if preprocessed_hashes is not None:
+                    dirty_sources, dirty_headers = self._skip_unchanged_preprocessed(dirty_sources, dirty_headers, preprocessed_hashes)
         else:
             for source_node in source_nodes:
-                dirty_sources.append((source_node.path, source_node.object_path, source_node.h_path))
-                dirty_headers.append((source_node.h_path, source_node.gch_path, None))
+                h_path = source_node.h_path if source_node.include_paths else None
+                dirty_sources.append((source_node.path, source_node.object_path, h_path))
+                if h_path is not None:
+                    dirty_headers.append((h_path, source_node.gch_path, None))
+        # Sources with the same includes share their precompiled header, which only needs to be built once.
+        dirty_headers = list(dict.fromkeys(dirty_headers))
         logging.info("done.")
+        key = counters.target_key(self)
+        counters.current.count(key, "dirty", len(dirty_sources))
+        counters.current.count(key, "cached", len(source_nodes) - len(dirty_sources))
 
-        bin_path = join(self.bin_dir, self.name)
-        is_bin_dirty = len(dirty_sources) > 0 or not isfile(bin_path)
-        failed = False
+        if shard is not None:
+            dirty_sources, dirty_headers = self._shard_share(dirty_sources, dirty_headers, shard)
+        changed_objects = list(dict.fromkeys(installed_objects + [object_path for source_path, object_path, h_path in dirty_sources]))
+
+        import cbob.cache
+        cache_keys = None
+        if dirty_sources and cbob.cache.current is not None:
+            with phase(self, "cache"):
+                dirty_sources, dirty_headers, cache_keys = self._fetch_cached_objects(cbob.cache.current, source_nodes, dirty_sources, dirty_headers)
+
+        try:
+            failed = self._compile_dirty(dirty_sources, dirty_headers, keep_going, cache_keys, preprocessed_hashes)
+        finally:
+            self.signatures.save()
+        return source_nodes, changed_objects, failed
+
+    def _shard_share(self, dirty_sources, dirty_headers, shard):
+        from cbob.analyze import latest_compile_times
+        from cbob.build_log import read
+        from cbob.shards import split
+        index, count = shard
+        entries = read(self.build_log_path)
+        # Times recorded by shard builds would make shards of the same split disagree
+        shard_builds = {entry.build_id for entry in entries if entry.kind == "shard"}
+        compile_times = latest_compile_times(entry for entry in entries if entry.build_id not in shard_builds)
+        self.build_log.record("shard", 0, 0, 0, [], "{}/{}".format(index, count))
+        source_by_name = {basename(source[1]): source for source in dirty_sources}
+        known_times = [compile_times[source[1]] for source in dirty_sources if source[1] in compile_times]
+        default_time = sum(known_times) / len(known_times) if known_times else 1.0
+        weights = {name: compile_times.get(source[1], default_time) for name, source in source_by_name.items()}
+        share = [source_by_name[name] for name in split(weights, count)[index - 1]]
+        logging.info("shard {} of {}: compiling {} of {} sources".format(index, count, len(share), len(dirty_sources)))
+        needed_h_paths = {h_path for source_path, object_path, h_path in share}
+        return share, [header for header in dirty_headers if header[0] in needed_h_paths]
+
+    def _write_bundle(self, shard, object_paths, failed):
+        from cbob.shards import write_bundle
+        from cbob.toolchain import compiler_version
+        if failed:
+            from cbob.error import CbobError
+            raise CbobError("skip writing the object bundle because of compilation errors")
+        index, count = shard
+        bundle_path = join(os.path.dirname(self.output_path), "{}.shard-{}-of-{}.tar".format(self.display_name, index, count))
+        os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+        manifest = {
+            "target": self.display_name,
+            "shard": [index, count],
+            "compiler": compiler_version(self.compiler, self.project),
+            "flags": list(self.compile_flags),
+            "objects": [basename(object_path) for object_path in object_paths]}
+        write_bundle(bundle_path, manifest, object_paths)
+        logging.info("wrote the objects to '{}'".format(bundle_path))
+
+    def _install_bundles(self, bundles, source_nodes):
+        # The objects are installed like compiled here, so that only what they don't cover is compiled
+        from cbob.shards import read_objects
+        from cbob.toolchain import compiler_version
+        node_by_name = {basename(node.object_path): node for node in source_nodes}
+        installed_objects = []
+        for bundle_path, manifest in bundles:
+            if manifest.get("flags") != list(self.compile_flags) or manifest.get("compiler") != compiler_version(self.compiler, self.project):
+                from cbob.error import CbobError
+                raise CbobError("the objects in '{}' were compiled with other flags or another compiler than target '{}'".format(bundle_path, self.display_name))
+            for name, data in read_objects(bundle_path, manifest):
+                node = node_by_name.get(name)
+                if node is None:
+                    logging.warning("'{}' in '{}' isn't the object of a source of target '{}'".format(name, bundle_path, self.display_name))
+                    continue
+                tmp_path = node.object_path + ".tmp"
+                with open(tmp_path, "wb") as object_file:
+                    object_file.write(data)
+                os.replace(tmp_path, node.object_path)
+                stat_cache.current.forget(node.object_path)
+                source = (node.path, node.object_path, node.h_path if node.include_paths else None)
+                self.signatures.record(node.object_path, _compile_cmd(source, self.compiler, ("-c",) + self.compile_flags, True), node.preprocessed_hash)
+                installed_objects.append(node.object_path)
+            logging.info("installed the objects of '{}'".format(bundle_path))
+        self.signatures.save()
+        return installed_objects
+
+    def _mark_changed_commands(self, source_nodes, dirty_sources, dirty_headers):
+        # Outputs made by another command line or compiler are rebuilt, even if they are newer than
+        # everything they depend on.
+        dirty_objects = {object_path for source_path, object_path, h_path in dirty_sources}
+        dirty_gchs = {gch_path for h_path, gch_path, _ in dirty_headers}
+        for node in source_nodes:
+            h_path = node.h_path if node.include_paths else None
+            source = (node.path, node.object_path, h_path)
+            if node.object_path not in dirty_objects:
+                if self.signatures.matches(node.object_path, _compile_cmd(source, self.compiler, ("-c",) + self.compile_flags, True)):
+                    continue
+                dirty_sources.append(source)
+                dirty_objects.add(node.object_path)
+            if h_path is not None and node.gch_path not in dirty_gchs:
+                header = (h_path, node.gch_path, None)
+                if not self.signatures.matches(node.gch_path, _compile_cmd(header, self.compiler, self.compile_flags)):
+                    dirty_headers.append(header)
+                    dirty_gchs.add(node.gch_path)
+
+    def _skip_unchanged_preprocessed(self, dirty_sources, dirty_headers, preprocessed_hashes):
+        # A source that preprocesses to the same text as when its object was compiled (by the same
+        # command) only had comments or blank lines change. Its object is left alone - touched, it
+        # would look newer than the outputs linked from it (see `_link`). The next build compares the
+        # texts again, but it scans the source anyway.
+        remaining_sources = []
+        for source in dirty_sources:
+            object_path = source[1]
+            if (self.signatures.preprocessed_hash(object_path) == preprocessed_hashes[object_path]
+                    and self.signatures.matches(object_path, _compile_cmd(source, self.compiler, ("-c",) + self.compile_flags, True))
+                    and stat_cache.current.isfile(object_path)):
+                continue
+            else:
+                remaining_sources.append(source)
+        needed_h_paths = {h_path for source_path, object_path, h_path in remaining_sources}
+        return remaining_sources, [header for header in dirty_headers if header[0] in needed_h_paths]
 
+    def _compile_dirty(self, dirty_sources, dirty_headers, keep_going, cache_keys, preprocessed_hashes):
+        # Returns whether some compilation failed (with `keep_going`, that is).
+        key = counters.target_key(self)
+        failed = False
         if dirty_sources:
             # precompile headers
             if dirty_headers:
                 logging.info("precompiling headers ...")
                 compile_func = partial(
                         _compile,
-                        compiler_path=self.compiler)
-                for source_file, result in self.worker_pool.imap_unordered(compile_func, dirty_headers):
-                    if result != 0:
-                        if keep_going:
-                            logging.warning("compilation of header '{}' failed".format(source_file))
-                            failed = True
-                        else:
-                            from cbob.error import CbobError
-                            raise CbobError("compilation of header '{}' failed".format(source_file))
+                        compiler_path=self.compiler,
+                        target=self,
+                        flags=self.compile_flags)
+                with phase(self, "pch"):
+                    for source_file, result in self.local_pool.imap_unordered(compile_func, dirty_headers):
+                        counters.current.count(key, "pch_builds")
+                        if result != 0:
+                            counters.current.count(key, "failures")
+                            if keep_going:
+                                logging.warning("compilation of header '{}' failed".format(source_file))
+                                failed = True
+                            else:
+                                from cbob.error import CbobError
+                                raise CbobError("compilation of header '{}' failed".format(source_file))
                 logging.info("done.")
 
             # compile sources
@@ -325,96 +764,208 @@ class Target(object):
             compile_func = partial(
                     _compile,
                     compiler_path=self.compiler,
+                    target=self,
+                    flags=("-c",) + self.compile_flags,
                     c_switch=True,
-                    include_pch=True)
-            for source_file, result in self.worker_pool.imap_unordered(compile_func, dirty_sources):
-                if result != 0:
-                    if keep_going:
-                        logging.warning("compilation of file '{}' failed".format(source_file))
-                        failed = True
-                    else:
-                        from cbob.error import CbobError
-                        raise CbobError("compilation of file '{}' failed".format(source_file))
-                    
+                    include_pch=True,
+                    cache_keys=cache_keys,
+                    preprocessed_hashes=preprocessed_hashes)
+            with phase(self, "compile"):
+                for source_file, result in self.worker_pool.imap_unordered(compile_func, dirty_sources):
+                    counters.current.count(key, "compiled")
+                    if result != 0:
+                        counters.current.count(key, "failures")
+                        if keep_going:
+                            logging.warning("compilation of file '{}' failed".format(source_file))
+                            failed = True
+                        else:
+                            from cbob.error import CbobError
+                            raise CbobError("compilation of file '{}' failed".format(source_file))
+
             logging.info("done.")
+        return failed
+
+    def _link(self, source_nodes, changed_objects, failed):
+        key = counters.target_key(self)
+        bin_path = self.output_path
+        # Executables and shared libraries are relinked if the content of a library they link against
+        # changed, static libraries don't link against anything.
+        libraries = self.link_libraries if self.kind != "static" else []
+        link_inputs = ["{} {}".format(_read_first_line(library.output_digest_path), library.output_path) for library in libraries]
+        object_file_names = [node.object_path for node in source_nodes]
+        # Objects are shared by the targets that compile them alike, so another target may have
+        # recompiled some since the output was made here - or may still be compiling them (links
+        # run in the background, see `build`).
+        self.output_jobs.claim(object_file_names)
+        changed_objects = list(dict.fromkeys(changed_objects + _newer_files(object_file_names, bin_path)))
+        is_bin_dirty = (len(changed_objects) > 0
+                or not stat_cache.current.isfile(bin_path)
+                or link_inputs != _read_lines(join(self.state_path, "link_inputs")))
 
         if is_bin_dirty:
             if failed:
                 from cbob.error import CbobError
                 raise CbobError("skip linking because of compilation errors")
-            # link
-            object_file_names = [node.object_path for node in source_nodes]
-            cmd = [self.compiler, "-o", bin_path] + object_file_names
+            if self.kind == "static":
+                cmd = self._archive_cmd(bin_path, object_file_names, changed_objects)
+            else:
+                # The flags of the options go along, some (like '-fsanitize=...') are needed for linking as well
+                cmd = [self.compiler] + list(LINKERS[self.linker]) + list(self.option_flags) + ["-o", bin_path] + object_file_names + [library.output_path for library in libraries]
+                if self.kind == "shared":
+                    cmd.insert(1, "-shared")
+                for rpath in dict.fromkeys(os.path.dirname(library.output_path) for library in libraries if library.kind == "shared"):
+                    cmd.append("-Wl,-rpath," + rpath)
             logging.info("linking ...")
             logging.info("  " + bin_path)
-            return_code = subprocess.call(cmd)
+            os.makedirs(os.path.dirname(bin_path), exist_ok=True)
+            from cbob.build_log import wait
+            start = self.build_log.now()
+            with phase(self, "link"), span("link " + bin_path, "link", target=self.display_name, cmd=cmd), counters.job(self):
+                return_code, max_rss = wait(popen(cmd))
+            self.build_log.record("link", start, return_code, max_rss, cmd, bin_path)
+            stat_cache.current.forget(bin_path)
             if return_code != 0:
+                counters.current.count(key, "failures")
                 from cbob.error import CbobError
-                raise CbobError("linking failed")
+                raise CbobError("linking of '{}' failed".format(bin_path))
+            _write_lines(join(self.state_path, "link_inputs"), link_inputs)
+            if self.kind != "executable":
+                self._write_output_digest(bin_path, object_file_names)
             logging.info("done.")
         else:
             logging.info("Nothing to do.")
         self.run_plugins("post_build")
 
-    def _calculate_dependencies(self):
-        from itertools import zip_longest
-        source_nodes = []
-        header_node_index = {}
-        # This is somewhat straight-forward if you have ever written a stream-parser (like SAX) in that we maintain a stack
-        # of where we currently sit in the tree.
-        # It adds a twist, though, in that we save references to processed nodes in a set. It may be a bit unintuitive that
-        # we only skip a node if it was in another node's dependencies - but note how, when we process a node, we don't add
-        # an edge to that very node, but to the node one layer *down* in the stack. Think about it for a while, then it makes
-        # sense.
-        processed_nodes = set()
-
-        get_dep_info = partial(_get_dep_info, gcc_path=self.project.gcc_path)
-        for file_path, deps in self.worker_pool.imap_unordered(get_dep_info, self.sources):
-            node = SourceNode(file_path, self)
-            source_nodes.append(node)
-            parent_nodes_stack = [node]
-
-            includes = []
-
-            for current_depth, dep_path in deps:
-                includes.append("#include \"" + dep_path + "\"\n")
-                if dep_path in header_node_index:
-                    current_node = header_node_index[dep_path]
-                    if current_node in processed_nodes:
-                        continue
-                    processed_nodes |= current_node.dependencies
+    def _archive_cmd(self, archive_path, object_paths, changed_objects):
+        # Thin archives only refer to the objects, so updating one means replacing the changed
+        # objects' entries (and the symbol table). If the set of objects changed, it's rebuilt.
+        members_path = join(self.state_path, "archive_members")
+        if _read_lines(members_path) == object_paths and stat_cache.current.isfile(archive_path):
+            members = changed_objects
+        else:
+            if isfile(archive_path):
+                os.remove(archive_path)
+            _write_lines(members_path, object_paths)
+            members = object_paths
+        return [self.project.ar_path, "rcsT", archive_path] + members
+
+    def _write_output_digest(self, output_path, object_paths):
+        # Dependents compare this digest to decide whether they need to be relinked. A thin archive
+        # doesn't contain its objects, so for static libraries it's the objects that are hashed.
+        from hashlib import sha256 as hashfn
+        digest = hashfn()
+        for path in (object_paths if self.kind == "static" else (output_path,)):
+            with open(path, "rb") as f:
+                content = f.read()
+            counters.current.add(bytes_read=len(content))
+            digest.update(hashfn(content).digest())
+        new_digest = digest.hexdigest()
+        if _read_first_line(self.output_digest_path) != new_digest:
+            _write_lines(self.output_digest_path, [new_digest])
+
+    def _fetch_cached_objects(self, cache, source_nodes, dirty_sources, dirty_headers):
+        import cbob.hashing
+        from itertools import chain
+        from cbob.cache import object_key
+        node_by_object = {node.object_path: node for node in source_nodes}
+        compiler_id = cache.compiler_id(self.compiler)
+        system_headers = {source_path: self.dep_graph.system_headers(source_path) for source_path, object_path, h_path in dirty_sources}
+        # The files are hashed in parallel first (most of them only if they changed since the last build)
+        hashed_paths = {path for source_path, object_path, h_path in dirty_sources
+                for path in chain([source_path], node_by_object[object_path].include_paths, system_headers[source_path])}
+        for _ in self.local_pool.imap_unordered(self.dep_graph.content_hash, hashed_paths):
+            pass
+        cbob.hashing.get(self.project).save()
+        cache_keys = {
+            object_path: object_key(compiler_id, ("-c",) + self.compile_flags, node_by_object[object_path], self.dep_graph.content_hash, self.project.root_path, system_headers[source_path])
+            for source_path, object_path, h_path in dirty_sources}
+
+        def fetch(source):
+            with span(source[0], "cache get", target=self.display_name):
+                return source, cache.get(cache_keys[source[1]])
+
+        key = counters.target_key(self)
+        remaining_sources = []
+        for source, data in self.worker_pool.imap_unordered(fetch, dirty_sources):
+            if data is None:
+                remaining_sources.append(source)
+                continue
+            object_path = source[1]
+            tmp_path = object_path + ".tmp"
+            with open(tmp_path, "wb") as object_file:
+                object_file.write(data)
+            os.replace(tmp_path, object_path)
+            stat_cache.current.forget(object_path)
+            self.signatures.record(object_path, _compile_cmd(source, self.compiler, ("-c",) + self.compile_flags, True), node_by_object[object_path].preprocessed_hash)
+            counters.current.count(key, "cache_hits")
+        counters.current.count(key, "cache_misses", len(remaining_sources))
+        # Precompiled headers are only needed for what is still left to compile
+        needed_h_paths = {h_path for source_path, object_path, h_path in remaining_sources}
+        remaining_headers = [header for header in dirty_headers if header[0] in needed_h_paths]
+        return remaining_sources, remaining_headers, cache_keys
+
+    def stats(self, count):
+        from cbob.build_log import read
+        import time
+        entries = read(self.build_log_path)
+        builds = {}
+        for entry in entries:
+            builds.setdefault(entry.build_id, []).append(entry)
+        if not builds:
+            print("No builds of target '{}' recorded yet.".format(self.name))
+            return
+
+        print("Builds (most recent last):")
+        for build_id, build_entries in list(builds.items())[-count:]:
+            kinds = {}
+            failures = 0
+            duration = 0
+            succeeded = True
+            for entry in build_entries:
+                if entry.kind == "build":
+                    duration = max(duration, entry.end - entry.start)
+                    succeeded = entry.status == 0
                 else:
-                    current_node = HeaderNode(dep_path)
-                    header_node_index[dep_path] = current_node
-
-                parent_nodes_stack[:] = parent_nodes_stack[:current_depth]
-                parent_nodes_stack[-1].dependencies.add(current_node)
-                parent_nodes_stack.append(current_node)
-
-            # For every source file, we generate a corresponding `.h` file that consists of all the
-            # `#include`s of that source file. This is the `node.h_path`. It is saved in one
-            # of *cbob*s mysterious directories. After we processed a source file, we check if it is
-            # up to date by doing a line-by-line comparison with a newly created `#include` list.
-            overwrite_header = False
-            try:
-                with open(node.h_path, "r") as uncompiled_header:
-                    for newline, oldline in zip_longest(includes, uncompiled_header):
-                        if newline != oldline:
-                            overwrite_header = True
-                            break
-            except IOError:
-                overwrite_header = True
-
-            # It the uncompiled header file changed, we save it and delete any existing precompiled header.
-            if overwrite_header:
-                with open(node.h_path, "w") as uncompiled_header:
-                    uncompiled_header.writelines(includes)
-                try:
-                    os.remove(node.gch_path)
-                except OSError:
-                    # It's OK if it didn't work; it just means that it wasn't there in the first place
-                    pass
-        return source_nodes
+                    kinds[entry.kind] = kinds.get(entry.kind, 0) + 1
+                    failures += entry.status != 0
+            jobs = ", ".join("{} {}".format(kinds.get(kind, 0), kind) for kind in ("scan", "pch", "compile", "link"))
+            if failures:
+                jobs += ", {} failed".format(failures)
+            print("  {}  {:9.3f} s  ({}){}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(build_id / 1000)),
+                duration / 1000, jobs, "" if succeeded else "  FAILED"))
+
+        # Compare every translation unit's most recent compile with the one before it.
+        latest = {}
+        previous = {}
+        for entry in entries:
+            if entry.kind == "compile" and entry.status == 0:
+                if entry.output in latest:
+                    previous[entry.output] = latest[entry.output]
+                latest[entry.output] = entry
+        if latest:
+            print("Slowest translation units (last compile, change to the compile before, peak memory):")
+            duration = lambda entry: entry.end - entry.start
+            for entry in sorted(latest.values(), key=duration, reverse=True)[:count]:
+                if entry.output in previous:
+                    trend = "{:+9.3f} s".format((duration(entry) - duration(previous[entry.output])) / 1000)
+                else:
+                    trend = "{:>11}".format("(new)")
+                print("  {:9.3f} s  {}  {:7} kB  {}".format(duration(entry) / 1000, trend, entry.max_rss, entry.output))
+
+        compiles = sum(1 for entry in entries if entry.kind == "compile")
+        pch_builds = sum(1 for entry in entries if entry.kind == "pch")
+        if compiles:
+            # Every compile that didn't need its precompiled header to be (re-)built first counts as a hit.
+            hit_rate = max(0, compiles - pch_builds) / compiles
+            print("Precompiled header hit rate: {:.1%} ({} compiles, {} precompiled headers built)".format(hit_rate, compiles, pch_builds))
+
+    def analyze(self, count, sort, parse_times):
+        if not self.sources:
+            logging.info("No sources - nothing to analyze.")
+            return
+        from cbob.analyze import print_header_costs
+        print_header_costs(self, count, sort, parse_times)
 
     def _guess_target_language(self):
         for file_name in self.sources:
@@ -426,14 +977,47 @@ class Target(object):
                 return "C++"
         return None
 
-    def configure(self, auto, force, compiler, bin_dir):
+    def configure(self, auto, force, compiler, bin_dir, kind=None, linker=None, rebuild_check=None, content_hashes=None):
         #if not None in {compiler, bin_dir}:
         #    auto = True
+        # (The command line only offers these, but plugins may call this, too)
+        for name, value, values in (("kind", kind, TARGET_KINDS),
+                                    ("linker", linker, ("auto",) + tuple(LINKERS)),
+                                    ("rebuild check", rebuild_check, REBUILD_CHECKS),
+                                    ("content hash source", content_hashes, CONTENT_HASHES)):
+            if value is not None and value not in values:
+                from cbob.error import CbobError
+                raise CbobError("'{}' is not a {} (one of {}).".format(value, name, ", ".join(values)))
+        if kind is not None and kind != self.kind:
+            kind_symlink = join(self.path, "kind")
+            if islink(kind_symlink):
+                os.unlink(kind_symlink)
+            os.symlink(kind, kind_symlink)
+            self.kind = None
+        if rebuild_check is not None and rebuild_check != self.rebuild_check:
+            rebuild_check_symlink = join(self.path, "rebuild_check")
+            if islink(rebuild_check_symlink):
+                os.unlink(rebuild_check_symlink)
+            os.symlink(rebuild_check, rebuild_check_symlink)
+            self.rebuild_check = None
+        if content_hashes is not None and content_hashes != self.content_hashes:
+            content_hashes_symlink = join(self.path, "content_hashes")
+            if islink(content_hashes_symlink):
+                os.unlink(content_hashes_symlink)
+            os.symlink(content_hashes, content_hashes_symlink)
+            self.content_hashes = None
+        # Switching compilers is fine, the objects made by the old one are rebuilt
         if compiler is not None:
-            os.symlink(compiler, join(self.path, "compiler"))
+            compiler_symlink = join(self.path, "compiler")
+            if islink(compiler_symlink):
+                os.unlink(compiler_symlink)
+            os.symlink(compiler, compiler_symlink)
             self.compiler = None
         if bin_dir is not None:
-            os.symlink(bin_dir, join(self.path, "bin_dir"))
+            bin_dir_symlink = join(self.path, "bin_dir")
+            if islink(bin_dir_symlink):
+                os.unlink(bin_dir_symlink)
+            os.symlink(bin_dir, bin_dir_symlink)
             self.bin_dir = None
         if auto:
             if compiler is None:
@@ -449,8 +1033,62 @@ class Target(object):
                     bindir_auto = assumed_bindir if isdir(assumed_bindir) else self.project.root_path
                     os.symlink(bindir_auto, bin_dir_symlink)
                     self.bin_dir = None
+            if linker is None and self.kind != "static":
+                linker_symlink = self._check_prepare_symlink("linker", "linker", force)
+                if linker_symlink is not None:
+                    os.symlink(self._detect_linker(), linker_symlink)
+                    self.linker = None
+        if linker is not None:
+            if linker == "auto":
+                linker = self._detect_linker()
+            linker_symlink = join(self.path, "linker")
+            if islink(linker_symlink):
+                os.unlink(linker_symlink)
+            os.symlink(linker, linker_symlink)
+            self.linker = None
         logging.info("compiler: '{}', "
-                     "binary output directory: '{}'".format(self.compiler, self.bin_dir))
+                     "binary output directory: '{}', "
+                     "kind: '{}', "
+                     "linker: '{}', "
+                     "rebuild check: '{}', "
+                     "content hashes: '{}'".format(self.compiler, self.bin_dir, self.kind, self.linker, self.rebuild_check, self.content_hashes))
+
+    def _detect_linker(self, repeat=3):
+        # Tries every linker `-fuse-ld` knows on the target's objects (if it was built before and
+        # they can be linked on their own) or on a tiny program, and picks the fastest one.
+        import subprocess
+        import tempfile
+        import time
+        compiler_path = self.compiler
+        with tempfile.TemporaryDirectory(prefix="cbob-linkers-") as tmp_dir:
+            output_path = join(tmp_dir, "out")
+            object_paths = [path for path in map(self.object_path, self.sources) if isfile(path)]
+            shared = ["-shared"] if self.kind == "shared" else []
+            def link(flags):
+                cmd = [compiler_path] + shared + list(flags) + ["-o", output_path] + object_paths
+                return subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if not object_paths or link(()) != 0:
+                source_path = join(tmp_dir, "main.c")
+                with open(source_path, "w") as source_file:
+                    source_file.write("int main(void) { return 0; }\n")
+                object_paths = [join(tmp_dir, "main.o")]
+                if subprocess.call([compiler_path, "-c", source_path, "-o", object_paths[0]], stderr=subprocess.DEVNULL) != 0:
+                    logging.warning("could not compile a test program to find the fastest linker")
+                    return "default"
+            timings = {}
+            for name, flags in LINKERS.items():
+                runs = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    if link(flags) != 0:
+                        break
+                    runs.append(time.perf_counter() - start)
+                else:
+                    timings[name] = min(runs)
+                    logging.info("linker '{}': {:.3f} s".format(name, timings[name]))
+        if not timings:
+            return "default"
+        return min(timings, key=timings.get)
 
     def _check_prepare_symlink(self, name, description, force):
         symlink = join(self.path, name)
@@ -465,6 +1103,7 @@ class Target(object):
 
 
     def _find_compiler_path(self):
+        import subprocess
         try:
             if self.language is "C":
                 path_from_var = expandvars("$CC")
@@ -489,22 +1128,30 @@ class Target(object):
             raise CbobError("No compiler for language '{}' found (might be cbob's fault).".format(self.language))
         return compiler_path
 
-    def _clean_dir(self, dir_path):
-        for file_name in os.listdir(dir_path):
-            file_path = join(dir_path, file_name)
-            os.remove(file_path)
-            logging.debug("removed file '{}'".format(file_name))
-
-
     def clean(self, all_, object_files, pch_files, bin_file):
-        if all_ or object_files:
-            self._clean_dir(self.dirs.objects)
+        # The store depends on the compiler: without one, the target hasn't put anything there
+        has_store = islink(join(self.path, "compiler"))
+        if (all_ or object_files) and has_store:
+            # Other targets may share the store, so only this target's objects go
+            for object_path in map(self.object_path, self.sources):
+                try:
+                    os.remove(object_path)
+                except OSError:
+                    pass
             logging.info("cleaned object files")
-        if all_ or pch_files:
-            self._clean_dir(self.dirs.precompiled_headers)
+        if (all_ or pch_files) and has_store:
+            # ... and only its precompiled headers (which depend on what its sources include)
+            for node in self.dep_graph.roots:
+                if not node.include_paths:
+                    continue
+                for path in (node.h_path, node.gch_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
             logging.info("cleaned precompiled header files")
-        if all_ or bin_file:
-            bin_path = join(self.bin_dir, self.name)
+        if (all_ or bin_file) and islink(join(self.path, "bin_dir")):
+            bin_path = self.output_path
             try:
                 os.remove(bin_path)
                 logging.debug("removed binary file '{}'".format(bin_path))
@@ -517,7 +1164,8 @@ class Target(object):
         if hookname in self.plugins:
             for func in self.plugins[hookname].values():
                 logging.debug("running plugin function '{}'".format(func))
-                func(self)
+                with span("{} {}".format(hookname, func.__module__), "plugin", target=self.display_name):
+                    func(self)
 
     def _remove_something_from_globs(self, dirname, globs, thing):
         self.project._remove_something_from_globs(join(self.path, dirname), globs, thing, self.name)
@@ -533,19 +1181,200 @@ class Target(object):
             from cbob.error import NotConfiguredError
             raise NotConfiguredError(self.name) from e
 
-def _compile(source, compiler_path, c_switch=False, include_pch=False):
+class OutputJobs(object):
+    # The compilations of a build by their output (an object or a precompiled header). Targets that
+    # share a store may ask for the same output: the first one makes it, the others wait for it. An
+    # output is made at most once per build, and not at all anymore once a link has read it.
+    def __init__(self):
+        import threading
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def run(self, output_path, make):
+        from concurrent.futures import Future
+        with self._lock:
+            future = self._futures.get(output_path)
+            making = future is None
+            if making:
+                future = self._futures[output_path] = Future()
+        if not making:
+            return future.result()
+        try:
+            result = make()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def claim(self, output_paths):
+        # Waits for the outputs being made, and keeps the others as they are
+        from concurrent.futures import Future
+        with self._lock:
+            futures = []
+            for output_path in output_paths:
+                future = self._futures.get(output_path)
+                if future is None:
+                    future = self._futures[output_path] = Future()
+                    future.set_result(0)
+                futures.append(future)
+        for future in futures:
+            future.exception()
+
+def _copy_outcome(future, done_future):
+    if done_future.exception() is not None:
+        future.set_exception(done_future.exception())
+    else:
+        future.set_result(done_future.result())
+
+def _compile(source, compiler_path, target, flags=(), c_switch=False, include_pch=False, cache_keys=None, preprocessed_hashes=None):
     # This function is later used as a partial (curried) function, with the `file_path` parameter being mapped
     # to a list of files to compile.
+    source_path, output_path, h_path = source
+    make = partial(_make_output, source, compiler_path, target, flags, c_switch, include_pch, cache_keys, preprocessed_hashes)
+    return source_path, target.output_jobs.run(output_path, make)
+
+def _make_output(source, compiler_path, target, flags, c_switch, include_pch, cache_keys, preprocessed_hashes):
     source_path, output_path, h_path = source
     logging.info("  " + source_path)
+    cmd = _compile_cmd(source, compiler_path, flags, include_pch)
+
+    return_code = _run_compile_job(cmd, source_path, output_path, h_path, compiler_path, target, c_switch)
+    stat_cache.current.forget(output_path)
+    if return_code == 0:
+        target.signatures.record(output_path, cmd, preprocessed_hashes.get(output_path) if preprocessed_hashes else None)
+    else:
+        target.signatures.discard(output_path)
+    cache_key = cache_keys.get(output_path) if cache_keys else None
+    if return_code == 0 and cache_key is not None:
+        import cbob.cache
+        with open(output_path, "rb") as object_file:
+            data = object_file.read()
+        with span(source_path, "cache put", target=target.display_name):
+            cbob.cache.current.put(cache_key, data)
+    return return_code
+
+def _compile_cmd(source, compiler_path, flags=(), include_pch=False):
+    source_path, output_path, h_path = source
     cmd = [compiler_path, source_path, "-o", output_path]
-    if c_switch:
-        cmd.append("-c")
+    cmd += flags
     if include_pch and h_path is not None:
         cmd += ["-fpch-preprocess", "-include", h_path]
-
-    process = subprocess.Popen(cmd)
-    return source_path, process.wait()
+    return cmd
+
+def _run_compile_job(cmd, source_path, output_path, h_path, compiler_path, target, c_switch):
+    import cbob.remote
+    from cbob.remote import codegen_flags
+    kind = "compile" if c_switch else "pch"
+    workers = cbob.remote.current
+    if workers is None:
+        return _compile_locally(cmd, kind, source_path, output_path, target)
+    # Precompiled headers would have to be shipped to the workers along with every job, so they
+    # (just like linking) are always done locally.
+    address = workers.acquire(local_only=not c_switch or codegen_flags(target.compile_flags) is None)
+    if address is not None:
+        try:
+            return_code = _compile_remotely(cmd, source_path, output_path, h_path, compiler_path, target, workers, address)
+        finally:
+            workers.release(address)
+        if return_code is not None:
+            return return_code
+        address = workers.acquire(local_only=True)
+    try:
+        return _compile_locally(cmd, kind, source_path, output_path, target)
+    finally:
+        workers.release(address)
+
+def _compile_locally(cmd, kind, source_path, output_path, target):
+    from cbob.build_log import wait
+    start = target.build_log.now()
+    with span(source_path, kind, target=target.display_name, cmd=cmd), counters.job(target):
+        return_code, max_rss = wait(popen(cmd))
+    target.build_log.record(kind, start, return_code, max_rss, cmd, output_path)
+    return return_code
+
+def _compile_remotely(cmd, source_path, output_path, h_path, compiler_path, target, workers, address):
+    # Returns None if the worker failed (as opposed to the compilation), so that the caller falls
+    # back to compiling locally.
+    import subprocess
+    import sys
+    from cbob.remote import codegen_flags
+    preprocess_cmd = [compiler_path, source_path, "-E"] + list(target.compile_flags)
+    if h_path is not None:
+        preprocess_cmd += ["-include", h_path]
+    start = target.build_log.now()
+    with span(source_path, "compile", target=target.display_name, cmd=cmd, worker=address), counters.job(target):
+        with popen(preprocess_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            preprocessed, err = process.communicate()
+        if process.returncode != 0:
+            sys.stderr.write(err.decode(errors="replace"))
+            target.build_log.record("compile", start, process.returncode, 0, cmd, output_path)
+            return process.returncode
+        language = "C" if splitext(source_path)[1] == ".c" else "C++"
+        try:
+            return_code, err, output = workers.compile(address, compiler_path, language, codegen_flags(target.compile_flags), preprocessed)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("worker '{}' failed ({}) - compiling '{}' locally".format(address, e, source_path))
+            workers.discard(address)
+            return None
+    sys.stderr.write(err)
+    if return_code == 0:
+        with open(output_path, "wb") as output_file:
+            output_file.write(output)
+    counters.current.count(counters.target_key(target), "remote_compiles")
+    target.build_log.record("compile", start, return_code, 0, cmd, output_path)
+    return return_code
+
+def _newer_files(paths, output_path):
+    # The files that are newer than the output (if that exists), missing ones aren't
+    try:
+        output_mtime = stat_cache.current.mtime_ns(output_path)
+    except OSError:
+        return []
+    newer_paths = []
+    for path in paths:
+        try:
+            if stat_cache.current.mtime_ns(path) > output_mtime:
+                newer_paths.append(path)
+        except OSError:
+            pass
+    return newer_paths
+
+def _read_lines(path):
+    try:
+        with open(path) as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+def _read_first_line(path):
+    lines = _read_lines(path)
+    return lines[0] if lines else ""
+
+def _write_lines(path, lines):
+    with open(path, "w") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+_plugin_modules = {}
+
+def _load_plugin(abs_filename):
+    # Plugins are imported at most once per process (several targets may share a plugin), and
+    # the regular import machinery keeps their compiled bytecode in a `__pycache__` directory
+    # next to them, so they are only recompiled when they change.
+    try:
+        return _plugin_modules[abs_filename]
+    except KeyError:
+        pass
+    import importlib.util
+    name = splitext(basename(abs_filename))[0]
+    spec = importlib.util.spec_from_file_location(name, abs_filename)
+    if spec is None:
+        from cbob.error import CbobError
+        raise CbobError("Plugin '{}' can't be loaded (not a Python file?).".format(abs_filename))
+    plugin_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin_module)
+    _plugin_modules[abs_filename] = plugin_module
+    return plugin_module
 
 def get_target(raw_target_name=None):
     if raw_target_name == None:
@@ -0,0 +1,86 @@
+import os
+from os.path import join, normpath, realpath
+import threading
+
+# What cbob knows about the compilers it runs. A compiler is identified by its (real) path, mtime,
+# size and a hash of its `--version` output. Asking the compiler itself is only done when one of
+# the former changed, the answers are kept in `.cbob/objects/compilers`, a line per compiler:
+# `<real path>\t<mtime in ns>\t<size>\t<version hash>\t<system include dirs, separated by ':'>`.
+
+_compilers = {}
+_lock = threading.Lock()
+
+def read_fields(path):
+    try:
+        with open(path) as f:
+            return [line.rstrip("\n").split("\t") for line in f]
+    except OSError:
+        return []
+
+def write_fields(path, lines):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write("".join("\t".join(fields) + "\n" for fields in lines))
+    os.replace(tmp_path, path)
+
+def _run(cmd):
+    import subprocess
+    from cbob.counters import popen
+    with popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
+        out = process.communicate()[0]
+    return process.returncode, out
+
+def _ask_system_include_dirs(compiler_path):
+    # The C++ search list contains the C one (but the C++ compiler may not be installed)
+    for language in ("c++", "c"):
+        returncode, out = _run((compiler_path, "-E", "-v", "-x", language, os.devnull))
+        if returncode == 0:
+            break
+    else:
+        return []
+    lines = out.decode(errors="replace").split("\n")
+    try:
+        start = lines.index("#include <...> search starts here:") + 1
+        end = lines.index("End of search list.", start)
+    except ValueError:
+        return []
+    return [normpath(line.strip().replace(" (framework directory)", "")) for line in lines[start:end]]
+
+def _compiler_info(compiler_path, project):
+    with _lock:
+        if compiler_path in _compilers:
+            return _compilers[compiler_path]
+        # Compilers may be given by name only, like `gcc`
+        import shutil
+        found_path = shutil.which(compiler_path)
+        if found_path is None:
+            from cbob.error import CbobError
+            raise CbobError("compiler '{}' wasn't found".format(compiler_path))
+        binary_path = realpath(found_path)
+        stat = os.stat(binary_path)
+        key = [binary_path, str(stat.st_mtime_ns), str(stat.st_size)]
+        cache_path = join(project.dirs.objects, "compilers")
+        known = read_fields(cache_path)
+        for fields in known:
+            if fields[:3] == key and len(fields) == 5:
+                version_hash, include_dirs = fields[3], fields[4]
+                break
+        else:
+            from hashlib import sha1
+            version_hash = sha1(_run((compiler_path, "--version"))[1]).hexdigest()[:16]
+            include_dirs = ":".join(_ask_system_include_dirs(compiler_path))
+            # An updated compiler replaces the old entry of its path
+            known = [fields for fields in known if fields[:1] != key[:1]] + [key + [version_hash, include_dirs]]
+            write_fields(cache_path, known)
+        _compilers[compiler_path] = (" ".join(key + [version_hash]), tuple(filter(None, include_dirs.split(":"))), version_hash)
+        return _compilers[compiler_path]
+
+def compiler_identity(compiler_path, project):
+    return _compiler_info(compiler_path, project)[0]
+
+def system_include_dirs(compiler_path, project):
+    return _compiler_info(compiler_path, project)[1]
+
+def compiler_version(compiler_path, project):
+    # Unlike the identity, this is the same on other machines with the same compiler
+    return _compiler_info(compiler_path, project)[2]
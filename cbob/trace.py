@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+# Writes trace files in the Chrome trace-event format (which Perfetto reads as well), see
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+class Tracer(object):
+    def __init__(self):
+        self.events = []
+        self._thread_names = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start = time.perf_counter()
+
+    def add_span(self, name, category, start, end, args):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._start) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid,
+            "tid": thread.ident,
+            "args": args}
+        with self._lock:
+            self.events.append(event)
+            self._thread_names[thread.ident] = thread.name
+
+    def write(self, path):
+        import json
+        with self._lock:
+            metadata = [{
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": tid,
+                "args": {"name": thread_name}} for tid, thread_name in self._thread_names.items()]
+            events = metadata + self.events
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+_tracer = None
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+
+def stop(path):
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.write(path)
+
+def is_tracing():
+    return _tracer is not None
+
+@contextmanager
+def span(name, category="cbob", **args):
+    # Spans are recorded in the thread they run in, so a span opened in a worker shows up
+    # in that worker's track.
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add_span(name, category, start_time, time.perf_counter(), args)
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 
+import json
 import os
-from os.path import join, abspath, isfile
+from os.path import join, abspath, dirname, isfile
 import subprocess
 import tempfile
 import unittest
@@ -47,6 +48,27 @@ int main() {
 }
 """
 
+COUNTING_MAIN_C = """
+#include "counting.h"
+
+int main() {
+    return count() - COUNT;
+}
+"""
+
+COUNTING_COUNT_C = """
+#include "counting.h"
+
+int count() {
+    return COUNT;
+}
+"""
+
+COUNTING_H = """
+#define COUNT 3
+extern int count();
+"""
+
 PRE_BUILD_PY = """
 def pre_build(target):
     print("Hello pre-build")
@@ -63,9 +85,10 @@ class TestCbobCLI(unittest.TestCase):
         cls.project_dir = tempfile.TemporaryDirectory()
         cls.project_path = cls.project_dir.name
 
-        cbob_path = abspath("cbob.py") 
+        cbob_path = abspath("cbob.py")
         assert(isfile(cbob_path))
         cls.cbob_cmd = ["python3", cbob_path]
+        cls.cbob_dir = dirname(cbob_path)
 
         files = {
             "src": {
@@ -87,7 +110,12 @@ class TestCbobCLI(unittest.TestCase):
             },
             "error": {
                 "error.c": ERROR_C
-            }
+            },
+            "counting": {
+                "main.c": COUNTING_MAIN_C,
+                "count.c": COUNTING_COUNT_C,
+                "counting.h": COUNTING_H,
+            },
         }
 
         cls.files = {}
@@ -120,6 +148,11 @@ class TestCbobCLI(unittest.TestCase):
         out = subprocess.check_output(cmd, universal_newlines=True)
         return {line.strip() for line in out.split() if line}
 
+    def _get_build_stats(self, *args):
+        cmd = self.cbob_cmd + ["build", "--stats"] + list(args)
+        out = subprocess.check_output(cmd, universal_newlines=True)
+        return {name.strip(): float(value) for name, value in (line.rsplit(None, 1) for line in out.split("\n") if line.startswith("  "))}
+
     def _get_err_words_cmd(self, *args):
         cmd = self.cbob_cmd + list(args)
         with open(os.devnull, "w") as null:
@@ -128,6 +161,12 @@ class TestCbobCLI(unittest.TestCase):
                 return {line.strip() for line in out.split() if line}
 
 
+    def test_a0_startup_imports(self):
+        # Modules only needed for building must not be imported when cbob starts up
+        cmd = ("python3", "-c", "import sys, cbob.main, cbob.target; print(' '.join(sys.modules))")
+        out_set = set(subprocess.check_output(cmd, universal_newlines=True, cwd=self.cbob_dir).split())
+        self.assertFalse({"subprocess", "multiprocessing", "hashlib", "imp", "cbob.node"} & out_set)
+
     def test_a1_init(self):
         self.assertEqual(self._call_cmd("init"), 0)
         self.assertNotEqual(self._call_cmd("init", silent=True), 0)
@@ -245,6 +284,18 @@ class TestCbobCLI(unittest.TestCase):
     def test_h5_build(self):
         self.assertEqual(self._call_cmd("build", "--target", "all"), 0)
 
+    def test_h6_build_trace(self):
+        trace_path = join(self.project_path, "trace.json")
+        self._call_cmd("build", "--target", "all", "--oneshot", "--trace", trace_path, silent=True)
+        with open(trace_path) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+        spans = [event for event in events if event["ph"] == "X"]
+        self.assertTrue({"scan", "cbob"} <= {event["cat"] for event in spans})
+        # Several sources may be scanned by one process
+        scanned = {path for event in spans if event["cat"] == "scan" for path in event["args"]["cmd"]}
+        self.assertTrue(set(self.files["src"].values()) <= scanned)
+        self.assertTrue(all(event["args"]["target"] == "hello" for event in spans if event["cat"] == "scan"))
+
     def test_h7_depend_remove(self):
         self.assertEqual(self._call_cmd("dependencies", "remove", "--target", "all", "hello"), 0)
         err_set = self._get_err_words_cmd("-v", "dependencies", "remove", "--target", "all", "hello")
@@ -358,7 +409,387 @@ class TestCbobCLI(unittest.TestCase):
         self.assertFalse({"Hello", "post-build"} < out_set)
         out_set = self._get_words_cmd("plugins", "list")
         self.assertFalse(set(self.files["plugins"].values()) < out_set)
-        
+
+    def test_o1_stats(self):
+        # All the builds of the default target so far should have been recorded
+        out_set = self._get_words_cmd("stats", "--count", "100")
+        self.assertTrue({"Builds", "scan,", "compile,"} < out_set)
+        # The 'error' target was never configured, so its build failed right away
+        out_set = self._get_words_cmd("stats", "--target", "error")
+        self.assertIn("FAILED", out_set)
+
+    def test_o2_analyze(self):
+        out_set = self._get_words_cmd("analyze", "--sort", "dependents")
+        self.assertTrue(set(self.files["include"].values()) < out_set)
+        out_set = self._get_words_cmd("analyze", "--count", "1", "--parse-times")
+        self.assertEqual(len(set(self.files["include"].values()) & out_set), 1)
+
+    def test_o3_time_report(self):
+        from cbob.analyze import parse_time_report
+        # As printed by GCC 12, with padded percentages
+        report = ("Time variable                                   usr           sys          wall           GGC\n"
+                " phase setup                        :   0.00 (  0%)   0.00 (  0%)   0.00 (  0%)  1326k ( 72%)\n"
+                " phase parsing                      :   0.01 (100%)   0.00 (  0%)   0.02 ( 67%)   528k ( 28%)\n"
+                " TOTAL                              :   0.01          0.00          0.03         1855k\n")
+        self.assertEqual(parse_time_report(report), 0.02)
+        self.assertIsNone(parse_time_report("cc1: unrecognized option\n"))
+
+    def test_p1_counting_build(self):
+        self.assertEqual(self._call_cmd("new", "counting"), 0)
+        sources = [path for path in self.files["counting"].values() if path.endswith(".c")]
+        self.assertEqual(self._call_cmd("add", "--target", "counting", *sources), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "counting", "--auto"), 0)
+        stats = self._get_build_stats("--target", "counting")
+        # scan and compile each source, precompile the header, link
+        self.assertLessEqual(stats["spawns"], 2 * len(sources) + 2)
+
+    def test_p2_noop_build_bounds(self):
+        stats = self._get_build_stats("--target", "counting")
+        # Nothing to compile or link, only the dependency scan may spawn processes
+        self.assertLessEqual(stats["spawns"], 2)
+        # object, precompiled header and source file for each source, plus the header and binary
+        self.assertLessEqual(stats["stat_calls"], 12)
+        self.assertLessEqual(stats["bytes_read"], sum(os.path.getsize(path) for path in self.files["counting"].values()))
+
+    def test_p3_one_file_changed_bounds(self):
+        subprocess.call(("touch", self.files["counting"]["count.c"]))
+        stats = self._get_build_stats("--target", "counting")
+        # scan both sources, compile the changed one, link
+        self.assertLessEqual(stats["spawns"], 4)
+        self.assertLessEqual(stats["stat_calls"], 12)
+        self.assertIn("phase counting:compile", stats)
+
+    def test_p4_profile(self):
+        for profile_name in ("counting.prof", "counting.folded"):
+            profile_path = join(self.project_path, profile_name)
+            err_set = self._get_err_words_cmd("--profile=" + profile_path, "build", "--target", "counting", "--oneshot")
+            self.assertTrue({"cbob's", "own", "functions:"} < err_set)
+            self.assertTrue(isfile(profile_path))
+        import pstats
+        pstats.Stats(join(self.project_path, "counting.prof"))
+
+    def test_p5_metrics_file(self):
+        metrics_path = join(self.project_path, "counting.prom")
+        subprocess.call(("touch", self.files["counting"]["count.c"]))
+        self.assertEqual(self._call_cmd("build", "--target", "counting", "--metrics-file", metrics_path), 0)
+        with open(metrics_path) as metrics_file:
+            samples = dict(line.rsplit(" ", 1) for line in metrics_file.read().split("\n") if line and not line.startswith("#"))
+        labels = 'project="{}",target="counting"'.format(os.path.basename(self.project_path))
+        self.assertEqual(samples["cbob_build_sources{" + labels + ',state="dirty"}'], "1")
+        self.assertEqual(samples["cbob_build_sources{" + labels + ',state="cached"}'], "1")
+        self.assertEqual(samples["cbob_build_sources{" + labels + ',state="skipped"}'], "0")
+        self.assertEqual(samples["cbob_build_failures{" + labels + "}"], "0")
+        self.assertEqual(samples["cbob_build_success{" + labels + "}"], "1")
+        self.assertGreaterEqual(int(samples["cbob_build_peak_parallelism{" + labels + "}"]), 1)
+        self.assertIn("cbob_build_phase_seconds{" + labels + ',phase="compile"}', samples)
+
+    def test_p6_remote_workers(self):
+        worker_cmd = self.cbob_cmd + ["worker", "--port", "0", "--jobs", "2"]
+        with subprocess.Popen(worker_cmd, stdout=subprocess.PIPE, universal_newlines=True) as worker:
+            try:
+                address = worker.stdout.readline().split()[-3]
+                self.assertEqual(self._call_cmd("build", "--target", "counting", "--oneshot", "--workers", address), 0)
+                # The worker's slots are only for compiling: a single local job scans both sources at once
+                # (one scan, the precompiled header, preprocessing both sources for the worker and linking)
+                stats = self._get_build_stats("--target", "counting", "--oneshot", "--jobs", "1", "--workers", address)
+                self.assertEqual(stats["spawns"], 5)
+            finally:
+                worker.terminate()
+            out = worker.stdout.read()
+        self.assertEqual(out.count(": ok "), 4)
+        # Without the worker, everything is compiled locally
+        self.assertEqual(self._call_cmd("build", "--target", "counting", "--oneshot", "--workers", address, silent=True), 0)
+
+    def test_p7_object_cache(self):
+        cache_dir = join(self.project_path, "cache")
+        metrics_path = join(self.project_path, "cache.prom")
+        server_cmd = ("python3", "-m", "cbob.cache_server", "--port", "0", "--dir", cache_dir)
+        with subprocess.Popen(server_cmd, stdout=subprocess.PIPE, universal_newlines=True, cwd=self.cbob_dir) as server:
+            try:
+                url = server.stdout.readline().split()[5]
+                self.assertEqual(self._call_cmd("build", "--target", "counting", "--oneshot", "--cache", url, "--metrics-file", metrics_path), 0)
+                self.assertEqual(sum(len(files) for _, _, files in os.walk(cache_dir)), 2)
+                with open(metrics_path) as metrics_file:
+                    metrics = metrics_file.read()
+                self.assertIn('result="hit"} 0\n', metrics)
+                self.assertIn('result="miss"} 2\n', metrics)
+                self.assertEqual(self._call_cmd("build", "--target", "counting", "--oneshot", "--cache", url, "--metrics-file", metrics_path), 0)
+            finally:
+                server.terminate()
+        with open(metrics_path) as metrics_file:
+            metrics = metrics_file.read()
+        self.assertIn('result="hit"} 2\n', metrics)
+        self.assertIn('result="miss"} 0\n', metrics)
+
+    def test_p7b_system_headers_in_cache_keys(self):
+        system_dir = join(self.project_path, "sysinc")
+        app_dir = join(self.project_path, "sysapp")
+        os.mkdir(system_dir)
+        os.mkdir(app_dir)
+        with open(join(system_dir, "outer.h"), "w") as outer_file:
+            outer_file.write("#include <inner.h>\n")
+        inner_path = join(system_dir, "inner.h")
+        with open(inner_path, "w") as inner_file:
+            inner_file.write("#define VALUE 4\n")
+        main_path = join(app_dir, "main.c")
+        with open(main_path, "w") as main_file:
+            main_file.write("#include <outer.h>\nint main() { return VALUE - 4; }\n")
+        compiler_path = join(app_dir, "sys-cc")
+        with open(compiler_path, "w") as compiler_file:
+            compiler_file.write("#!/bin/sh\nexec cc -isystem {} \"$@\"\n".format(system_dir))
+        os.chmod(compiler_path, 0o755)
+        self.assertEqual(self._call_cmd("new", "sysapp"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "sysapp", main_path), 0)
+        # (Scanned by the same compiler, which knows the header directory)
+        self.assertEqual(self._call_cmd("configure", "--target", "sysapp", "--auto", "--compiler", compiler_path, "--rebuild-check", "preprocessed"), 0)
+        cache_dir = join(self.project_path, "syscache")
+        server_cmd = ("python3", "-m", "cbob.cache_server", "--port", "0", "--dir", cache_dir)
+        with subprocess.Popen(server_cmd, stdout=subprocess.PIPE, universal_newlines=True, cwd=self.cbob_dir) as server:
+            try:
+                url = server.stdout.readline().split()[5]
+                self.assertEqual(self._call_cmd("build", "--target", "sysapp", "--cache", url), 0)
+                # A nested system header is rewritten in place, its directory's mtime doesn't change
+                with open(inner_path, "w") as inner_file:
+                    inner_file.write("#define VALUE 5\n")
+                subprocess.call(("touch", main_path))
+                self.assertEqual(self._call_cmd("build", "--target", "sysapp", "--cache", url), 0)
+            finally:
+                server.terminate()
+        # Not the cached object of the old header
+        self.assertEqual(subprocess.call(join(self.bin_dir, "sysapp")), 1)
+
+    def test_q1_static_library(self):
+        self.assertEqual(self._call_cmd("new", "countlib"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "countlib", self.files["counting"]["count.c"]), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countlib", "--auto"), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countlib", "--kind", "static"), 0)
+        self.assertEqual(self._call_cmd("new", "countapp"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "countapp", self.files["counting"]["main.c"]), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countapp", "--auto"), 0)
+        self.assertEqual(self._call_cmd("dependencies", "add", "--target", "countapp", "countlib"), 0)
+        self.assertEqual(self._call_cmd("build", "--target", "countapp"), 0)
+        self.assertTrue(isfile(join(self.bin_dir, "libcountlib.a")))
+        self.assertEqual(subprocess.call(join(self.bin_dir, "countapp")), 0)
+
+    def test_q2_library_unchanged_no_relink(self):
+        # The recompiled object is the same as before, so the archive's content didn't change
+        subprocess.call(("touch", self.files["counting"]["count.c"]))
+        stats = self._get_build_stats("--target", "countapp")
+        self.assertIn("phase countlib:link", stats)
+        self.assertNotIn("phase countapp:link", stats)
+
+    def test_q3_linker(self):
+        self.assertEqual(self._call_cmd("configure", "--target", "countapp", "--linker", "auto"), 0)
+        linker = os.readlink(join(self.project_path, ".cbob", "targets", "countapp", "linker"))
+        self.assertIn(linker, ("default", "bfd", "gold", "lld", "mold"))
+        self.assertEqual(self._call_cmd("build", "--target", "countapp", "--oneshot", "--link-jobs", "2"), 0)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "countapp")), 0)
+
+    def test_q4_shared_objects(self):
+        sources = [path for path in self.files["counting"].values() if path.endswith(".c")]
+        for target_name in ("counttwin", "countshared"):
+            self.assertEqual(self._call_cmd("new", target_name), 0)
+            self.assertEqual(self._call_cmd("add", "--target", target_name, *sources), 0)
+            self.assertEqual(self._call_cmd("configure", "--target", target_name, "--auto"), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countshared", "--kind", "shared"), 0)
+        # The objects of target 'counting' are compiled with the same compiler and flags
+        stats = self._get_build_stats("--target", "counttwin")
+        self.assertNotIn("phase counttwin:compile", stats)
+        self.assertIn("phase counttwin:link", stats)
+        # ... but not those of a shared library
+        stats = self._get_build_stats("--target", "countshared")
+        self.assertIn("phase countshared:compile", stats)
+
+    def test_q4b_shared_object_relinks(self):
+        sources = [path for path in self.files["counting"].values() if path.endswith(".c")]
+        self.assertEqual(self._call_cmd("new", "countcopy"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "countcopy", *sources), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countcopy", "--auto"), 0)
+        for target_name in ("counting", "countcopy"):
+            self.assertEqual(self._call_cmd("build", "--target", target_name), 0)
+        count_path = self.files["counting"]["count.c"]
+        with open(count_path, "w") as count_file:
+            count_file.write(COUNTING_COUNT_C.replace("return COUNT;", "return COUNT + 1;"))
+        # Target 'counting' recompiles the shared object, 'countcopy' still has to relink it
+        stats = self._get_build_stats("--target", "counting")
+        self.assertIn("phase counting:compile", stats)
+        stats = self._get_build_stats("--target", "countcopy")
+        self.assertNotIn("phase countcopy:compile", stats)
+        self.assertIn("phase countcopy:link", stats)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "countcopy")), 1)
+        stats = self._get_build_stats("--target", "countcopy")
+        self.assertNotIn("phase countcopy:link", stats)
+        with open(count_path, "w") as count_file:
+            count_file.write(COUNTING_COUNT_C)
+        self.assertEqual(self._call_cmd("build", "--target", "counting"), 0)
+
+    def test_q5_variants(self):
+        self.assertEqual(self._call_cmd("options", "new", "--target", "counting", "--choices", "debug", "release", "--", "build"), 0)
+        editor_path = join(self.project_path, "add_flags.sh")
+        for choice, flag in (("debug", "-g"), ("release", "-O2")):
+            with open(editor_path, "w") as editor_file:
+                editor_file.write("#!/bin/sh\necho '{}' >> \"$1\"\n".format(flag))
+            os.chmod(editor_path, 0o755)
+            self.assertEqual(self._call_cmd("options", "edit", "--target", "counting", "--choice", choice, "--editor", editor_path, "build"), 0)
+        stats = self._get_build_stats("--target", "counting", "--variants", "debug,release")
+        # Each variant has its own objects
+        self.assertIn("phase counting@debug:compile", stats)
+        self.assertIn("phase counting@release:compile", stats)
+        for variant in ("debug", "release"):
+            self.assertEqual(subprocess.call(join(self.bin_dir, variant, "counting")), 0)
+        stats = self._get_build_stats("--target", "counting", "--variants", "debug,release")
+        self.assertNotIn("phase counting@debug:compile", stats)
+        self.assertNotIn("phase counting@release:link", stats)
+
+    def test_q5b_variants_share_objects(self):
+        # Neither variant selects anything, so both compile alike - into the same store
+        stats = self._get_build_stats("--target", "countcopy", "--variants", "left,right", "--oneshot")
+        # One scan, one precompiled header and the two sources, but a link for each variant
+        self.assertEqual(stats["spawns"], 6)
+        self.assertEqual(len([name for name in stats if name.endswith(":compile")]), 1)
+        for variant in ("left", "right"):
+            self.assertEqual(subprocess.call(join(self.bin_dir, variant, "countcopy")), 0)
+        # (Target 'counting' shares the recompiled objects)
+        self.assertEqual(self._call_cmd("build", "--target", "counting"), 0)
+
+    def test_q5c_clean_shared_store(self):
+        other_dir = join(self.project_path, "pchother")
+        os.mkdir(other_dir)
+        other_path = join(other_dir, "other.c")
+        with open(other_path, "w") as other_file:
+            other_file.write("#include <stdlib.h>\nint main() { return EXIT_SUCCESS; }\n")
+        self.assertEqual(self._call_cmd("new", "pchother"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "pchother", other_path), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "pchother", "--auto"), 0)
+        for target_name in ("counting", "pchother"):
+            self.assertEqual(self._call_cmd("build", "--target", target_name), 0)
+        objects_dir = join(self.project_path, ".cbob", "objects")
+        def gch_paths():
+            return {join(dir_path, name) for dir_path, _, names in os.walk(objects_dir) for name in names if name.endswith(".gch")}
+        gch_paths_before = gch_paths()
+        # 'counting' compiles into the same store, but keeps its precompiled header and objects
+        self.assertEqual(self._call_cmd("clean", "--target", "pchother", "--all"), 0)
+        self.assertEqual(len(gch_paths_before - gch_paths()), 1)
+        stats = self._get_build_stats("--target", "counting")
+        self.assertNotIn("phase counting:pch", stats)
+        self.assertNotIn("phase counting:compile", stats)
+        stats = self._get_build_stats("--target", "pchother")
+        self.assertIn("phase pchother:pch", stats)
+        self.assertIn("phase pchother:compile", stats)
+        # Without a compiler, there is nothing in the store to clean
+        self.assertEqual(self._call_cmd("new", "unconfigured"), 0)
+        self.assertEqual(self._call_cmd("clean", "--target", "unconfigured", "--all"), 0)
+
+    def test_q6_compiler_changed(self):
+        compiler_path = join(self.project_path, "wrapped-cc")
+        with open(compiler_path, "w") as compiler_file:
+            compiler_file.write("#!/bin/sh\nexec cc \"$@\"\n")
+        os.chmod(compiler_path, 0o755)
+        self.assertEqual(self._call_cmd("configure", "--target", "counttwin", "--compiler", compiler_path), 0)
+        self.assertEqual(self._call_cmd("build", "--target", "counttwin"), 0)
+        stats = self._get_build_stats("--target", "counttwin")
+        self.assertNotIn("phase counttwin:compile", stats)
+        # Same path, but a different compiler - the objects are newer than the sources, yet stale
+        mtime = os.path.getmtime(compiler_path) + 10
+        os.utime(compiler_path, (mtime, mtime))
+        stats = self._get_build_stats("--target", "counttwin")
+        self.assertIn("phase counttwin:compile", stats)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "counttwin")), 0)
+
+    def test_q6b_compiler_by_name(self):
+        self.assertEqual(self._call_cmd("configure", "--target", "countcopy", "--compiler", "cc"), 0)
+        self.assertEqual(self._call_cmd("build", "--target", "countcopy"), 0)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "countcopy")), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "countcopy", "--compiler", "no-such-cc"), 0)
+        self.assertNotEqual(self._call_cmd("build", "--target", "countcopy", silent=True), 0)
+
+    def test_q7_batched_scan(self):
+        # With a single job, one GCC scans both sources
+        stats = self._get_build_stats("--target", "counting", "--jobs", "1")
+        self.assertEqual(stats["spawns"], 1)
+        subprocess.call(("touch", self.files["counting"]["counting.h"]))
+        stats = self._get_build_stats("--target", "counting", "--jobs", "1")
+        self.assertIn("phase counting:compile", stats)
+
+    def test_q7b_generated_header(self):
+        gen_dir = join(self.project_path, "gen")
+        os.mkdir(gen_dir)
+        with open(join(gen_dir, "lib.c"), "w") as lib_file:
+            lib_file.write("int lib() { return 0; }\n")
+        with open(join(gen_dir, "main.c"), "w") as main_file:
+            main_file.write("#include \"gen.h\"\nint lib();\nint main() { return lib() + GENERATED; }\n")
+        # The header appears after the dependency's build looked into the directory
+        plugin_path = join(gen_dir, "generate.py")
+        with open(plugin_path, "w") as plugin_file:
+            plugin_file.write("def pre_build(target):\n"
+                    "    with open({!r}, 'w') as f:\n"
+                    "        f.write('#define GENERATED 0\\n')\n".format(join(gen_dir, "gen.h")))
+        self.assertEqual(self._call_cmd("new", "genlib"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "genlib", join(gen_dir, "lib.c")), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "genlib", "--auto", "--kind", "static"), 0)
+        self.assertEqual(self._call_cmd("new", "genmain"), 0)
+        self.assertEqual(self._call_cmd("add", "--target", "genmain", join(gen_dir, "main.c")), 0)
+        self.assertEqual(self._call_cmd("configure", "--target", "genmain", "--auto"), 0)
+        self.assertEqual(self._call_cmd("dependencies", "add", "--target", "genmain", "genlib"), 0)
+        self.assertEqual(self._call_cmd("plugins", "add", "--target", "genmain", plugin_path), 0)
+        self.assertEqual(self._call_cmd("build", "--target", "genmain"), 0)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "genmain")), 0)
+
+    def test_q8_preprocessed_rebuild_check(self):
+        self.assertEqual(self._call_cmd("configure", "--target", "counttwin", "--rebuild-check", "preprocessed"), 0)
+        header_path = self.files["counting"]["counting.h"]
+        def edit_header(content):
+            with open(header_path, "w") as header_file:
+                header_file.write(content)
+            return self._get_build_stats("--target", "counttwin")
+        # Nothing to compare to yet
+        stats = edit_header(COUNTING_H + "/* a comment */\n")
+        self.assertIn("phase counttwin:compile", stats)
+        stats = edit_header(COUNTING_H + "\n/* another comment */\n\n")
+        self.assertNotIn("phase counttwin:compile", stats)
+        self.assertNotIn("phase counttwin:link", stats)
+        stats = edit_header(COUNTING_H.replace("3", "4"))
+        self.assertIn("phase counttwin:compile", stats)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "counttwin")), 0)
+        edit_header(COUNTING_H)
+
+    def test_q9_git_content_hashes(self):
+        import shutil
+        if shutil.which("git") is None:
+            self.skipTest("git isn't installed")
+        self.assertEqual(self._call_cmd("configure", "--target", "counting", "--content-hashes", "git"), 0)
+        # Files as new as the index would have to be hashed anyway
+        for path in self.files["counting"].values():
+            os.utime(path, (0, 0))
+        counting_dir = dirname(self.files["counting"]["counting.h"])
+        self.assertEqual(subprocess.call(("git", "init", "-q"), cwd=self.project_path), 0)
+        self.assertEqual(subprocess.call(("git", "add", counting_dir), cwd=self.project_path), 0)
+        cache_dir = join(self.project_path, "git_cache")
+        server_cmd = ("python3", "-m", "cbob.cache_server", "--port", "0", "--dir", cache_dir)
+        with subprocess.Popen(server_cmd, stdout=subprocess.PIPE, universal_newlines=True, cwd=self.cbob_dir) as server:
+            try:
+                url = server.stdout.readline().split()[5]
+                stats = self._get_build_stats("--target", "counting", "--oneshot", "--cache", url)
+            finally:
+                server.terminate()
+        # The blob ids come from the index, no file is read for them
+        self.assertEqual(stats["bytes_read"], 0)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(cache_dir)), 2)
+        self.assertEqual(self._call_cmd("configure", "--target", "counting", "--content-hashes", "files"), 0)
+
+    def test_r1_sharded_build(self):
+        bundle_paths = [join(self.bin_dir, "counting.shard-{}-of-2.tar".format(index)) for index in (1, 2)]
+        for index in (1, 2):
+            stats = self._get_build_stats("--target", "counting", "--oneshot", "--shard", "{}/2".format(index))
+            self.assertNotIn("phase counting:link", stats)
+            self.assertTrue(isfile(bundle_paths[index - 1]))
+        self.assertEqual(self._call_cmd("clean", "--target", "counting", "--objects"), 0)
+        # Both sources come from the bundles, only linking is left
+        stats = self._get_build_stats("--target", "counting", "--merge", *bundle_paths)
+        self.assertNotIn("phase counting:compile", stats)
+        self.assertIn("phase counting:link", stats)
+        self.assertEqual(subprocess.call(join(self.bin_dir, "counting")), 0)
+        self.assertNotEqual(self._call_cmd("build", "--target", "counting", "--shard", "3/2", silent=True), 0)
 
 
     @classmethod